@@ -1,24 +1,240 @@
 import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Iterable, TextIO
 
-from locations import City, Country, test_example_countries_and_cities
+import numpy as np
 
-def create_cities_countries_from_CSV(path_to_csv: str) -> None:
+from locations import CAPITAL_TYPES, CapitalType, City, Country, test_example_countries_and_cities
+
+SNAPSHOT_VERSION = 1    # bumped whenever the layout of the snapshot files changes
+
+
+def _csv_signature(path_to_csv: str) -> dict:
     """
-    Reads a CSV file given its path and creates instances of City and Country for each line.
+    Returns the size, modification time and SHA-256 hash of a CSV file, which identify the data it contains.
+    """
+    stat = os.stat(path_to_csv)
+    sha256 = hashlib.sha256()
+
+    with open(path_to_csv, 'rb') as csv_file:
+        for block in iter(lambda: csv_file.read(1 << 20), b''):
+            sha256.update(block)
+
+    return {"version": SNAPSHOT_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256.hexdigest()}
+
+
+def snapshot_path(path_to_csv: str) -> str:
+    """
+    Returns the path of the directory holding the snapshot of a CSV file.
+    """
+    return path_to_csv + ".snapshot"
+
+
+def save_snapshot(path_to_csv: str, countries: list[Country], rows: range) -> None:
+    """
+    Writes the given countries and the given rows of City.table (parsed from a CSV file) to the snapshot directory of this file.
+    The files are written to a new directory, which then replaces the previous snapshot as a whole: other processes may
+    have its files memory-mapped, and would read the new arrays (or crash) if they were written over.
+    """
+    directory = snapshot_path(path_to_csv)
+    parent = os.path.dirname(os.path.abspath(directory))
+    temporary = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".", dir=parent)
+
+    try:
+        _write_snapshot(temporary, path_to_csv, countries, rows)
+
+        # the previous snapshot is moved aside rather than written over, then removed (its mapped files stay readable)
+        previous = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".", dir=parent)
+        if os.path.isdir(directory):
+            os.rename(directory, os.path.join(previous, "snapshot"))
+        shutil.rmtree(previous)
+
+        # moving a directory is atomic, and fails if another process saved a snapshot in the meantime
+        try:
+            os.rename(temporary, directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    finally:
+        if os.path.isdir(temporary):
+            shutil.rmtree(temporary)
+
+
+def _write_snapshot(directory: str, path_to_csv: str, countries: list[Country], rows: range) -> None:
+    """
+    Writes the files of the snapshot of the given countries and rows of City.table to an empty directory.
+    """
+    table = City.table
+    country_names = [country.country_name for country in countries]
+    country_code_of = {country_name: code for code, country_name in enumerate(country_names)}
+
+    # the country codes are relative to the snapshot, as the ones of City.table depend on what was loaded before
+    to_snapshot_code = np.array([country_code_of.get(country_name, -1) for country_name in table.country_names], dtype=np.int32)
+
+    np.save(os.path.join(directory, "latitudes.npy"), table.latitudes[rows.start:rows.stop])
+    np.save(os.path.join(directory, "longitudes.npy"), table.longitudes[rows.start:rows.stop])
+    np.save(os.path.join(directory, "country_codes.npy"), to_snapshot_code[table.country_codes[rows.start:rows.stop]])
+    np.save(os.path.join(directory, "capital_codes.npy"), table.capital_codes[rows.start:rows.stop])
+    np.save(os.path.join(directory, "city_ids.npy"), table.city_ids[rows.start:rows.stop])
+
+    with open(os.path.join(directory, "strings.json"), 'w', encoding='utf-8') as strings_file:
+        json.dump({"names": table.names[rows.start:rows.stop],
+                   "countries": [[country.country_name, country.ISO_code] for country in countries]}, strings_file)
+
+    with open(os.path.join(directory, "signature.json"), 'w', encoding='utf-8') as signature_file:
+        json.dump(_csv_signature(path_to_csv), signature_file)
+
+
+def load_snapshot(path_to_csv: str) -> bool:
     """
+    Creates the countries and cities of a CSV file from its snapshot, with the arrays memory-mapped.
+    Returns False (and creates nothing) if there is no snapshot or if it does not match the current CSV file.
+    """
+    directory = snapshot_path(path_to_csv)
+
+    try:
+        with open(os.path.join(directory, "signature.json"), 'r', encoding='utf-8') as signature_file:
+            signature = json.load(signature_file)
+        if signature != _csv_signature(path_to_csv):
+            return False
 
-    country_list = []
+        with open(os.path.join(directory, "strings.json"), 'r', encoding='utf-8') as strings_file:
+            strings = json.load(strings_file)
+        columns = {column: np.load(os.path.join(directory, column + ".npy"), mmap_mode='r')
+                   for column in ("latitudes", "longitudes", "country_codes", "capital_codes", "city_ids")}
+    except (OSError, ValueError):
+        return False
 
-    with open(path_to_csv, 'r', encoding='utf-8') as csv_file:
-        csv_reader = csv.reader(csv_file)
-        header = next(csv_reader)
+    # creates the countries in the order of the CSV file, and maps the snapshot country codes to the ones of City.table
+    for country_name, iso3 in strings["countries"]:
+        Country(country_name, iso3)
+    to_table_code = np.array([City.table.country_code(country_name) for country_name, _ in strings["countries"]], dtype=np.int32)
 
-        for line in csv_reader:
-            if line[header.index('country')] not in country_list:
-                Country(line[header.index('country')], line[header.index('iso3')])
-                country_list.append(line[4])
+    rows = City.table.add_rows(strings["names"], columns["latitudes"], columns["longitudes"],
+                               to_table_code[columns["country_codes"]], columns["capital_codes"], columns["city_ids"])
+    City.from_rows(rows)
 
-            City(line[header.index('city_ascii')], line[header.index('lat')], line[header.index('lng')], line[header.index('country')], line[header.index('capital')], line[header.index('id')])
+    return True
+
+
+class LoadReport():
+    """
+    Summarises a load of cities and countries from CSV data.
+    """
+
+    def __init__(self, rows_read: int, countries: list[Country], city_rows: range, seconds: float) -> None:
+        """
+        Creates a report of a load that read rows_read rows and created the given countries and rows of City.table.
+        """
+        self.rows_read = rows_read      # number of data rows read (header excluded)
+        self.countries = countries      # the countries created, in the order they appear in the data
+        self.city_rows = city_rows      # the rows of City.table of the cities created
+        self.seconds = seconds          # duration of the load
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_read / self.seconds if self.seconds > 0 else float("inf")
+
+    def __str__(self) -> str:
+        """
+        Returns a one-line summary of the load, for example
+        "Loaded 44030 cities of 24 countries from 44030 rows in 0.21 s (209667 rows/s)".
+        """
+        return "Loaded {} cities of {} countries from {} rows in {:.2f} s ({:.0f} rows/s)".format(
+            len(self.city_rows), len(self.countries), self.rows_read, self.seconds, self.rows_per_second)
+
+
+def load_cities_countries(source: str | TextIO | Iterable[str], countries: list[str] = None,
+                          capital_types: list[CapitalType] = None) -> LoadReport:
+    """
+    Reads CSV data in a single streaming pass and creates instances of City and Country for its lines.
+    The source can be the path of a CSV file, an open file or any iterator of CSV lines (header first).
+
+    The argument countries can be given to only load the cities (and countries) of these country names,
+    and the argument capital_types to only load the cities of these capital types.
+    Returns a LoadReport with the countries and cities created and the number of rows read per second.
+    """
+    start_time = time.perf_counter()
+
+    # opens the file if given a path, and reads the lines of anything else as they are
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8') as csv_file:
+            return load_cities_countries(csv_file, countries, capital_types)
+
+    csv_reader = csv.reader(source)
+    header = next(csv_reader)
+
+    # resolves the position of every column used once, rather than once per line
+    name_col, lat_col, lng_col = header.index('city_ascii'), header.index('lat'), header.index('lng')
+    country_col, iso3_col = header.index('country'), header.index('iso3')
+    capital_col, id_col = header.index('capital'), header.index('id')
+
+    selected_countries = None if countries is None else set(countries)
+    capital_code_of = {capital_type.value: code for code, capital_type in enumerate(CAPITAL_TYPES)
+                       if capital_types is None or capital_type in capital_types}
+
+    country_code_of = dict()    # a dict that associates the names of the countries created to their City.table code
+    country_list = []           # stores the countries created, in order
+    names, latitudes, longitudes, country_codes, capital_codes, city_ids = [], [], [], [], [], []
+    rows_read = 0
+
+    for line in csv_reader:
+        rows_read += 1
+        country_name = line[country_col]
+
+        # creates the country the first time it appears (unless it is not selected)
+        country_code = country_code_of.get(country_name)
+        if country_code is None:
+            if selected_countries is not None and country_name not in selected_countries:
+                continue
+            country_list.append(Country(country_name, line[iso3_col]))
+            country_code = country_code_of[country_name] = City.table.country_code(country_name)
+
+        capital_code = capital_code_of.get(line[capital_col])
+        if capital_code is None:
+            CapitalType(line[capital_col])     # raises a ValueError for capital types that do not exist
+            continue
+
+        names.append(line[name_col])
+        latitudes.append(float(line[lat_col]))
+        longitudes.append(float(line[lng_col]))
+        country_codes.append(country_code)
+        capital_codes.append(capital_code)
+        city_ids.append(int(line[id_col]))
+
+    # adds every city to City.table at once, then creates the City views of the new rows
+    city_rows = City.table.add_rows(names, np.array(latitudes, dtype=np.float64), np.array(longitudes, dtype=np.float64),
+                                    np.array(country_codes, dtype=np.int32), np.array(capital_codes, dtype=np.int8),
+                                    np.array(city_ids, dtype=np.int64))
+    City.from_rows(city_rows)
+
+    return LoadReport(rows_read, country_list, city_rows, time.perf_counter() - start_time)
+
+
+def create_cities_countries_from_CSV(path_to_csv: str, use_snapshot: bool = True) -> None:
+    """
+    Reads a CSV file given its path and creates instances of City and Country for each line.
+
+    If use_snapshot is True, the cities and countries are loaded from the snapshot of the file when it is up to date,
+    and the snapshot is (re)written after parsing the file otherwise.
+    """
+
+    if use_snapshot and load_snapshot(path_to_csv):
+        return
+
+    report = load_cities_countries(path_to_csv)
+
+    if use_snapshot:
+        # a snapshot that cannot be written (e.g. read-only directory) only means the next start parses the file again
+        try:
+            save_snapshot(path_to_csv, report.countries, report.city_rows)
+        except OSError:
+            pass
 
 
 if __name__ == "__main__":
@@ -31,4 +247,3 @@ if __name__ == "__main__":
         print(city)
 
     test_example_countries_and_cities()
-
@@ -0,0 +1,460 @@
+from __future__ import annotations
+
+import heapq
+import math
+import os
+import tempfile
+import zipfile
+from typing import Callable, Iterable
+
+import numpy as np
+
+from locations import City
+from vehicles import Vehicle, as_hours
+
+WITNESS_SETTLE_LIMIT = 64   # maximum number of cities settled by a witness search before a shortcut is added anyway
+
+
+def _save_arrays(path: str, arrays: dict) -> None:
+    """
+    Writes named arrays to a .npz file.
+    The file is written next to the path first, then moved there, so that an interrupted save never leaves a partial file.
+    """
+    descriptor, temporary = tempfile.mkstemp(prefix=os.path.basename(path) + ".", dir=os.path.dirname(os.path.abspath(path)))
+
+    try:
+        with os.fdopen(descriptor, 'wb') as npz_file:
+            np.savez(npz_file, **arrays)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _load_arrays(path: str, names: tuple) -> dict | None:
+    """
+    Reads the arrays of the given names from a .npz file written by _save_arrays.
+    Returns None if there is no file at the path or if it does not have all of these arrays.
+    """
+    try:
+        with np.load(path) as arrays:
+            return {name: arrays[name] for name in names}
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+
+class ContractionHierarchy():
+    """
+    A contraction hierarchy of a vehicle graph.
+
+    Every city is given a rank, and cities are removed ("contracted") from the lowest rank to the highest,
+    adding a shortcut between two of their neighbours whenever the path through them was the only shortest one.
+    A shortest path then always goes up then down the ranks, so a query only searches the edges going up
+    from both cities, which is a tiny part of the graph.
+
+    The cities are numbered by rank, and the edges going up are stored as arrays in CSR form:
+    the edges of city i are targets[offsets[i]:offsets[i + 1]], with their weights and middles
+    (the city a shortcut goes through, or -1 for a direct trip).
+    """
+
+    def __init__(self, city_ids: np.ndarray, offsets: np.ndarray, targets: np.ndarray, weights: np.ndarray,
+                 middles: np.ndarray, signature: str) -> None:
+        """
+        Creates a hierarchy from its arrays, and the signature of the vehicle and cities it was built for.
+        """
+        self.city_ids = city_ids        # stores the city ID of every city, by rank
+        self.offsets = offsets          # stores where the edges of every city start in the arrays below
+        self.targets = targets          # stores the (higher) rank of the city every edge goes to
+        self.weights = weights          # stores the travel time of every edge
+        self.middles = middles          # stores the rank of the city every shortcut goes through (-1 if not a shortcut)
+        self.signature = signature      # identifies the vehicle and city set the hierarchy was built for
+
+        # the arrays are read as lists by the queries, which is much faster for single elements
+        self._offsets = offsets.tolist()
+        self._targets = targets.tolist()
+        self._weights = weights.tolist()
+        self._middles = middles.tolist()
+        self._city_id_of = [str(city_id) for city_id in city_ids.tolist()]
+        self._rank_of = {city_id: rank for rank, city_id in enumerate(self._city_id_of)}
+
+    @classmethod
+    def build(cls, cities: list[City], neighbours: Callable[[City], Iterable], signature: str) -> ContractionHierarchy:
+        """
+        Builds the hierarchy of a graph given its cities and a function yielding the (neighbour, travel time)
+        pairs of a city.
+        """
+        index_of = {city: index for index, city in enumerate(cities)}
+
+        # stores the edges of every city to the cities not contracted yet, as a dict of neighbour index -> (travel time, middle index or -1)
+        adjacency = [dict() for _ in cities]
+        for index, city in enumerate(cities):
+            for neighbour, leg_time in neighbours(city):
+                neighbour_index = index_of[neighbour]
+                if neighbour_index != index and leg_time < adjacency[index].get(neighbour_index, (math.inf,))[0]:
+                    adjacency[index][neighbour_index] = (leg_time, -1)
+                    adjacency[neighbour_index][index] = (leg_time, -1)
+
+        contracted_neighbours = [0] * len(cities)
+        up_edges = [None] * len(cities)     # the final edges going up of every city, recorded when it is contracted
+        order = []                          # the indices of the cities, in contraction order
+
+        # contracts the city with the lowest priority first; the priority of a city only changes when one of its neighbours
+        # is contracted, so only the neighbours are updated, and the entries with an outdated priority are skipped
+        priorities = [cls._priority(adjacency, contracted_neighbours, index) for index in range(len(cities))]
+        queue = [(priority, index) for index, priority in enumerate(priorities)]
+        heapq.heapify(queue)
+
+        while queue:
+            priority, index = heapq.heappop(queue)
+            if up_edges[index] is not None or priority != priorities[index]:
+                continue
+
+            shortcuts = cls._shortcuts(adjacency, index)
+
+            # removes the city from the graph, then adds the shortcuts replacing the paths through it
+            up_edges[index] = [(neighbour, leg_time, middle) for neighbour, (leg_time, middle) in adjacency[index].items()]
+            remaining = list(adjacency[index])
+            for neighbour in remaining:
+                del adjacency[neighbour][index]
+                contracted_neighbours[neighbour] += 1
+            adjacency[index] = dict()
+            order.append(index)
+
+            for first, second, leg_time in shortcuts:
+                if leg_time < adjacency[first].get(second, (math.inf,))[0]:
+                    adjacency[first][second] = (leg_time, index)
+                    adjacency[second][first] = (leg_time, index)
+
+            for neighbour in remaining:
+                priorities[neighbour] = cls._priority(adjacency, contracted_neighbours, neighbour)
+                heapq.heappush(queue, (priorities[neighbour], neighbour))
+
+        # numbers the cities by rank and stores the edges going up in CSR form
+        rank_of = [0] * len(cities)
+        for rank, index in enumerate(order):
+            rank_of[index] = rank
+
+        offsets, targets, weights, middles = [0], [], [], []
+        for index in order:
+            for neighbour, leg_time, middle in sorted(up_edges[index], key=lambda edge: rank_of[edge[0]]):
+                targets.append(rank_of[neighbour])
+                weights.append(leg_time)
+                middles.append(-1 if middle == -1 else rank_of[middle])
+            offsets.append(len(targets))
+
+        city_ids = np.array([int(cities[index].city_id) for index in order], dtype=np.int64)
+
+        return cls(city_ids, np.array(offsets, dtype=np.int64), np.array(targets, dtype=np.int64),
+                   np.array(weights, dtype=np.float64), np.array(middles, dtype=np.int64), signature)
+
+    @staticmethod
+    def _shortcuts(adjacency: list[dict], index: int) -> list[tuple]:
+        """
+        Returns the (first, second, travel time) shortcuts needed to contract a city: one between every two of its
+        neighbours for which no path avoiding the city (a witness) is as fast as going through it.
+        """
+        neighbours = [(neighbour, leg_time) for neighbour, (leg_time, _) in adjacency[index].items()]
+        shortcuts = []
+
+        for position, (first, first_time) in enumerate(neighbours):
+            targets = {second: first_time + second_time for second, second_time in neighbours[position + 1:]
+                       if adjacency[first].get(second, (math.inf,))[0] > first_time + second_time}
+            if not targets:
+                continue
+
+            # a bounded Dijkstra search from the first neighbour, avoiding the city being contracted,
+            # which stops once every target is settled
+            limit = max(targets.values())
+            best_time = {first: 0}
+            heap = [(0, first)]
+            settled = 0
+            remaining = len(targets)
+            while heap and settled < WITNESS_SETTLE_LIMIT and remaining:
+                time, city = heapq.heappop(heap)
+                if time > best_time[city]:
+                    continue
+                if time > limit:
+                    break
+                settled += 1
+                if city in targets:
+                    remaining -= 1
+                for neighbour, (leg_time, _) in adjacency[city].items():
+                    if neighbour != index and time + leg_time < best_time.get(neighbour, math.inf):
+                        best_time[neighbour] = time + leg_time
+                        heapq.heappush(heap, (time + leg_time, neighbour))
+
+            for second, via_time in targets.items():
+                if best_time.get(second, math.inf) > via_time:
+                    shortcuts.append((first, second, via_time))
+
+        return shortcuts
+
+    @staticmethod
+    def _priority(adjacency: list[dict], contracted_neighbours: list[int], index: int) -> int:
+        """
+        Returns the priority of a city: the number of shortcuts its contraction would add minus the number of edges it removes,
+        plus its number of contracted neighbours (so that the contractions are spread over the graph).
+        The shortcuts are estimated with witnesses of a single direct trip, which is much cheaper than the searches
+        of _shortcuts and never finds fewer of them.
+        """
+        neighbours = list(adjacency[index].items())
+        shortcuts = 0
+
+        for position, (first, (first_time, _)) in enumerate(neighbours):
+            first_edges = adjacency[first]
+            for second, (second_time, _) in neighbours[position + 1:]:
+                if first_edges.get(second, (math.inf,))[0] > first_time + second_time:
+                    shortcuts += 1
+
+        return shortcuts - len(neighbours) + contracted_neighbours[index]
+
+    def save(self, path: str) -> None:
+        """
+        Writes the hierarchy to a .npz file (see _save_arrays).
+        """
+        _save_arrays(path, {"city_ids": self.city_ids, "offsets": self.offsets, "targets": self.targets, "weights": self.weights,
+                            "middles": self.middles, "signature": np.array(self.signature)})
+
+    @classmethod
+    def load(cls, path: str) -> ContractionHierarchy | None:
+        """
+        Reads a hierarchy written by save.
+        Returns None if there is no file at the path or if it is not a complete hierarchy.
+        """
+        arrays = _load_arrays(path, ("city_ids", "offsets", "targets", "weights", "middles", "signature"))
+        if arrays is None:
+            return None
+
+        return cls(arrays["city_ids"], arrays["offsets"], arrays["targets"], arrays["weights"], arrays["middles"],
+                   str(arrays["signature"]))
+
+    def _edge(self, lower: int, higher: int) -> (float, int):
+        """
+        Returns the travel time and middle of the edge going up from one rank to a higher one.
+        """
+        for position in range(self._offsets[lower], self._offsets[lower + 1]):
+            if self._targets[position] == higher:
+                return self._weights[position], self._middles[position]
+        raise KeyError((lower, higher))
+
+    def _unpack(self, first: int, second: int, leg_time: float, middle: int, legs: list) -> None:
+        """
+        Appends the (rank, rank, travel time) direct trips that an edge stands for to legs, in order from first to second.
+        """
+        if middle == -1:
+            legs.append((first, second, leg_time))
+            return
+
+        # both halves of a shortcut go up from the middle, which was contracted before its two ends
+        first_time, first_middle = self._edge(middle, first)
+        second_time, second_middle = self._edge(middle, second)
+        self._unpack(first, middle, first_time, first_middle, legs)
+        self._unpack(middle, second, second_time, second_middle, legs)
+
+    def shortest_path(self, from_city: City, to_city: City) -> (list[City], list[float]) | None:
+        """
+        Returns the list of cities of a shortest path between two cities and the travel time of each of its legs,
+        or None if there is no path.
+        """
+        source, target = self._rank_of.get(from_city.city_id), self._rank_of.get(to_city.city_id)
+        if source is None or target is None:
+            return None
+        if source == target:
+            return [from_city], []
+
+        # a search going up from each end; the path is found where they meet
+        best_time = ({source: 0}, {target: 0})
+        previous = ({source: None}, {target: None})     # the (previous rank, travel time, middle) of every rank reached
+        heaps = ([(0, source)], [(0, target)])
+        shortest, meeting = math.inf, None
+
+        while heaps[0] or heaps[1]:
+            for direction in (0, 1):
+                if not heaps[direction]:
+                    continue
+
+                time, rank = heapq.heappop(heaps[direction])
+                if time > best_time[direction][rank]:
+                    continue
+
+                # nothing reached from here can improve the shortest path found so far
+                if time >= shortest:
+                    heaps[direction].clear()
+                    continue
+
+                other_time = best_time[1 - direction].get(rank)
+                if other_time is not None and time + other_time < shortest:
+                    shortest, meeting = time + other_time, rank
+
+                for position in range(self._offsets[rank], self._offsets[rank + 1]):
+                    neighbour, new_time = self._targets[position], time + self._weights[position]
+                    if new_time < best_time[direction].get(neighbour, math.inf):
+                        best_time[direction][neighbour] = new_time
+                        previous[direction][neighbour] = (rank, self._weights[position], self._middles[position])
+                        heapq.heappush(heaps[direction], (new_time, neighbour))
+
+        if meeting is None:
+            return None
+
+        # gets the edges from the source up to the meeting rank, then from the meeting rank down to the target
+        up_edges, rank = [], meeting
+        while previous[0][rank] is not None:
+            previous_rank, leg_time, middle = previous[0][rank]
+            up_edges.append((previous_rank, rank, leg_time, middle))
+            rank = previous_rank
+        up_edges.reverse()
+
+        down_edges, rank = [], meeting
+        while previous[1][rank] is not None:
+            next_rank, leg_time, middle = previous[1][rank]
+            down_edges.append((rank, next_rank, leg_time, middle))
+            rank = next_rank
+
+        legs = []
+        for first, second, leg_time, middle in up_edges + down_edges:
+            self._unpack(first, second, leg_time, middle, legs)
+
+        path = [from_city] + [City.cities[self._city_id_of[second]] for _, second, _ in legs]
+        return path, [as_hours(leg_time) for _, _, leg_time in legs]
+
+
+class HubTable():
+    """
+    The shortest travel times between the hubs of a vehicle whose direct trips are generated from groups of cities
+    (see Vehicle.leg_groups), e.g. the primary capitals of DiplomacyDonutDinghy.
+
+    The hubs are the cities in several groups or in a group that is not direct (see Vehicle.leg_group_is_direct),
+    and every other city belongs to a single direct group. A shortest path between two cities of the same direct group
+    is then the direct trip, and any other shortest path goes straight to a hub of the group of its first city,
+    then through hubs only, then straight to its last city. A query therefore only compares the few pairs of hubs
+    of the groups of both cities, looking up the travel times between hubs in a table (with the next hub of each
+    shortest path, to rebuild it).
+
+    The table has the number of hubs squared entries, and is built in the number of hubs cubed.
+    """
+
+    def __init__(self, vehicle: Vehicle, city_ids: np.ndarray, group_of: np.ndarray, access_offsets: np.ndarray,
+                 access_hubs: np.ndarray, hubs: np.ndarray, hub_times: np.ndarray, next_hubs: np.ndarray, signature: str) -> None:
+        """
+        Creates a table from its arrays, the vehicle computing the direct trips, and the signature of the vehicle
+        and cities it was built for.
+        """
+        self.vehicle = vehicle                  # stores the vehicle computing the direct trips to and from the hubs
+        self.city_ids = city_ids                # stores the city ID of every city
+        self.group_of = group_of                # stores the group of every city that is not a hub (-1 for the hubs)
+        self.access_offsets = access_offsets    # stores where the hubs of every city start in access_hubs
+        self.access_hubs = access_hubs          # stores the hubs every city goes to first (itself for a hub)
+        self.hubs = hubs                        # stores the index (in city_ids) of every hub
+        self.hub_times = hub_times              # stores the shortest travel time from every hub (rows) to every hub (columns)
+        self.next_hubs = next_hubs              # stores the hub following every hub (rows) on its shortest path to every hub (columns)
+        self.signature = signature              # identifies the vehicle and city set the table was built for
+
+        self._index_of = {str(city_id): index for index, city_id in enumerate(city_ids.tolist())}
+
+    @classmethod
+    def build(cls, vehicle: Vehicle, cities: list[City], groups: list[list[City]], direct: list[bool], signature: str) -> HubTable:
+        """
+        Builds the table of a vehicle given its cities, the groups of cities it connects and whether each group is direct.
+        """
+        index_of = {city: index for index, city in enumerate(cities)}
+        groups_of = [[] for _ in cities]
+        for group_index, group in enumerate(groups):
+            for city in group:
+                groups_of[index_of[city]].append(group_index)
+
+        is_hub = [len(city_groups) > 1 or any(not direct[group_index] for group_index in city_groups) for city_groups in groups_of]
+        hubs = [index for index in range(len(cities)) if is_hub[index]]
+        hub_number_of = {index: hub_number for hub_number, index in enumerate(hubs)}
+        group_hubs = [[hub_number_of[index_of[city]] for city in group if is_hub[index_of[city]]] for group in groups]
+
+        # every city goes to a hub of its group first, and a hub is its own first hub
+        group_of, access_offsets, access_hubs = [], [0], []
+        for index, city_groups in enumerate(groups_of):
+            if is_hub[index]:
+                group_of.append(-1)
+                access_hubs.append(hub_number_of[index])
+            else:
+                group_of.append(city_groups[0] if city_groups else -1)
+                access_hubs.extend(group_hubs[city_groups[0]] if city_groups else [])
+            access_offsets.append(len(access_hubs))
+
+        # the shortest paths between hubs only go through hubs (a city of a single direct group can be skipped),
+        # so they are found over the direct trips between hubs, with the Floyd-Warshall algorithm
+        hub_cities = [cities[index] for index in hubs]
+        hub_times = vehicle.travel_time_matrix(hub_cities, hub_cities).astype(np.float64)
+        np.fill_diagonal(hub_times, 0)
+        next_hubs = np.where(np.isfinite(hub_times), np.arange(len(hubs))[np.newaxis, :], -1)
+
+        for middle in range(len(hubs)):
+            through = hub_times[:, middle, np.newaxis] + hub_times[np.newaxis, middle, :]
+            shorter = through < hub_times
+            hub_times = np.where(shorter, through, hub_times)
+            next_hubs = np.where(shorter, next_hubs[:, middle, np.newaxis], next_hubs)
+
+        city_ids = np.array([int(city.city_id) for city in cities], dtype=np.int64)
+        return cls(vehicle, city_ids, np.array(group_of, dtype=np.int64), np.array(access_offsets, dtype=np.int64),
+                   np.array(access_hubs, dtype=np.int64), np.array(hubs, dtype=np.int64), hub_times, next_hubs.astype(np.int64), signature)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the table to a .npz file (see _save_arrays).
+        """
+        _save_arrays(path, {"city_ids": self.city_ids, "group_of": self.group_of, "access_offsets": self.access_offsets,
+                            "access_hubs": self.access_hubs, "hubs": self.hubs, "hub_times": self.hub_times,
+                            "next_hubs": self.next_hubs, "signature": np.array(self.signature)})
+
+    @classmethod
+    def load(cls, path: str, vehicle: Vehicle) -> HubTable | None:
+        """
+        Reads a table written by save, for the vehicle it was built for.
+        Returns None if there is no file at the path or if it is not a complete table.
+        """
+        arrays = _load_arrays(path, ("city_ids", "group_of", "access_offsets", "access_hubs", "hubs", "hub_times", "next_hubs", "signature"))
+        if arrays is None:
+            return None
+
+        return cls(vehicle, arrays["city_ids"], arrays["group_of"], arrays["access_offsets"], arrays["access_hubs"], arrays["hubs"],
+                   arrays["hub_times"], arrays["next_hubs"], str(arrays["signature"]))
+
+    def _access(self, city: City, index: int) -> (np.ndarray, np.ndarray):
+        """
+        Returns the hubs a city goes to first, and the travel time of the direct trip to each of them.
+        """
+        hub_numbers = self.access_hubs[self.access_offsets[index]:self.access_offsets[index + 1]]
+        hub_cities = [City.cities[str(city_id)] for city_id in self.city_ids[self.hubs[hub_numbers]].tolist()]
+        times = self.vehicle.travel_time_matrix([city], hub_cities)[0] if hub_cities else np.empty(0)
+        times[[hub_city is city for hub_city in hub_cities]] = 0
+
+        return hub_numbers, times
+
+    def shortest_path(self, from_city: City, to_city: City) -> (list[City], list[float]) | None:
+        """
+        Returns the list of cities of a shortest path between two cities and the travel time of each of its legs,
+        or None if there is no path.
+        """
+        source, target = self._index_of.get(from_city.city_id), self._index_of.get(to_city.city_id)
+        if source is None or target is None:
+            return None
+        if source == target:
+            return [from_city], []
+
+        # the direct trip is a shortest path between two cities of the same direct group
+        if self.group_of[source] != -1 and self.group_of[source] == self.group_of[target]:
+            return [from_city, to_city], [self.vehicle.compute_travel_time(from_city, to_city)]
+
+        # compares every pair of a first hub and a last hub at once
+        first_hubs, first_times = self._access(from_city, source)
+        last_hubs, last_times = self._access(to_city, target)
+        totals = first_times[:, np.newaxis] + self.hub_times[np.ix_(first_hubs, last_hubs)] + last_times[np.newaxis, :]
+        if totals.size == 0 or not np.isfinite(totals.min()):
+            return None
+        first, last = np.unravel_index(int(np.argmin(totals)), totals.shape)
+
+        # goes to the first hub, follows the next hubs to the last one, then goes to the destination
+        hub_numbers = [int(first_hubs[first])]
+        while hub_numbers[-1] != last_hubs[last]:
+            hub_numbers.append(int(self.next_hubs[hub_numbers[-1], last_hubs[last]]))
+        path = [from_city] + [City.cities[str(city_id)] for city_id in self.city_ids[self.hubs[hub_numbers]].tolist()] + [to_city]
+        path = [city for position, city in enumerate(path) if position == 0 or city is not path[position - 1]]
+
+        return path, [self.vehicle.compute_travel_time(city1, city2) for city1, city2 in zip(path, path[1:])]
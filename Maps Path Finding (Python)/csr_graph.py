@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+
+import networkx
+import numpy as np
+
+from locations import City
+from vehicles import as_hours
+
+CSR_GRAPH_VERSION = 1   # bumped whenever the layout of the graph files changes
+
+
+class CSRGraph():
+    """
+    A vehicle graph stored as arrays in CSR form, which can be saved to a directory and memory-mapped back,
+    so that the processes loading a same graph share it in the page cache instead of each building it.
+
+    The cities are numbered in the order of City.cities, and the edges of city i (stored both ways) go to the cities
+    neighbour_indices[offsets[i]:offsets[i + 1]], with the travel times weights[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, cities: list[City], offsets: np.ndarray, neighbour_indices: np.ndarray, weights: np.ndarray,
+                 signature: str) -> None:
+        """
+        Creates a graph from its cities, its arrays, and the signature of the vehicle and cities it was built for.
+        """
+        self.cities = cities                        # stores the cities, by index
+        self.offsets = offsets                      # stores where the edges of every city start in the arrays below
+        self.neighbour_indices = neighbour_indices  # stores the index of the city every edge goes to
+        self.weights = weights                      # stores the travel time of every edge
+        self.signature = signature                  # identifies the vehicle and city set the graph was built for
+
+        self.index_of = {city: index for index, city in enumerate(cities)}   # a dict that associates every city to its index
+
+    @classmethod
+    def from_graph(cls, graph: networkx.Graph, cities: list[City], signature: str) -> CSRGraph:
+        """
+        Converts a networkx vehicle graph over the given cities to CSR form.
+        The travel times are stored as int32 if they are all whole numbers of hours, as float64 otherwise.
+        """
+        index_of = {city: index for index, city in enumerate(cities)}
+        edges = [(index_of[city1], index_of[city2], weight) for city1, city2, weight in graph.edges(data='weight')]
+        firsts = np.array([edge[0] for edge in edges], dtype=np.int32)
+        seconds = np.array([edge[1] for edge in edges], dtype=np.int32)
+        leg_times = np.array([edge[2] for edge in edges], dtype=np.float64)
+
+        # every edge is stored from both of its cities, sorted by the city it leaves from
+        sources = np.concatenate((firsts, seconds))
+        order = np.argsort(sources, kind='stable')
+        neighbour_indices = np.concatenate((seconds, firsts))[order]
+        weights = np.concatenate((leg_times, leg_times))[order]
+        offsets = np.zeros(len(cities) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(sources, minlength=len(cities)), out=offsets[1:])
+
+        if np.array_equal(weights, np.floor(weights)) and (len(weights) == 0 or weights.max() <= np.iinfo(np.int32).max):
+            weights = weights.astype(np.int32)
+
+        return cls(cities, offsets, neighbour_indices, weights, signature)
+
+    def neighbours(self, city: City):
+        """
+        Yields every (neighbour, travel time) pair of a city.
+        """
+        index = self.index_of.get(city)
+        if index is None:
+            return
+
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        leg_times = self.weights[start:end].tolist()
+        if self.weights.dtype.kind == 'f':
+            leg_times = [as_hours(leg_time) for leg_time in leg_times]
+
+        for neighbour_index, leg_time in zip(self.neighbour_indices[start:end].tolist(), leg_times):
+            yield self.cities[neighbour_index], leg_time
+
+    def edges(self):
+        """
+        Yields every pair of cities connected by an edge, once.
+        """
+        for index, city in enumerate(self.cities):
+            start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+            for neighbour_index in self.neighbour_indices[start:end].tolist():
+                if neighbour_index > index:
+                    yield city, self.cities[neighbour_index]
+
+    def save(self, directory: str) -> None:
+        """
+        Writes the arrays of the graph to a directory.
+        The files are written to a new directory, which is only moved to the given path once complete, and a directory
+        already at this path (e.g. saved by another process) is kept as is: other processes may have its files
+        memory-mapped, and would read the new arrays (or crash) if they were written over.
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".", dir=parent)
+
+        try:
+            np.save(os.path.join(temporary, "offsets.npy"), self.offsets)
+            np.save(os.path.join(temporary, "neighbours.npy"), self.neighbour_indices)
+            np.save(os.path.join(temporary, "weights.npy"), self.weights)
+
+            # the files only become visible at the path once the whole directory is renamed below,
+            # so an interrupted save leaves a temporary directory (removed below) rather than a partial graph
+            with open(os.path.join(temporary, "signature.json"), 'w', encoding='utf-8') as signature_file:
+                json.dump({"version": CSR_GRAPH_VERSION, "signature": self.signature, "cities": len(self.cities)}, signature_file)
+
+            # moving a directory is atomic, and fails if another one is already at the path
+            try:
+                os.rename(temporary, directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        finally:
+            if os.path.isdir(temporary):
+                shutil.rmtree(temporary)
+
+    @classmethod
+    def load(cls, directory: str, cities: list[City], signature: str) -> CSRGraph | None:
+        """
+        Reads a graph written by save over the given cities, with its arrays memory-mapped.
+        Returns None if there is no graph in the directory or if it was built for another signature.
+        """
+        try:
+            with open(os.path.join(directory, "signature.json"), 'r', encoding='utf-8') as signature_file:
+                saved = json.load(signature_file)
+            if saved != {"version": CSR_GRAPH_VERSION, "signature": signature, "cities": len(cities)}:
+                return None
+
+            arrays = [np.load(os.path.join(directory, name + ".npy"), mmap_mode='r') for name in ("offsets", "neighbours", "weights")]
+        except (OSError, ValueError):
+            return None
+
+        return cls(cities, *arrays, signature)
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import hashlib
 import math
 from enum import Enum
+from multiprocessing import shared_memory
 from typing import Any
 from geopy import distance
+import numpy as np
 
 
 class CapitalType(Enum):
@@ -19,6 +22,113 @@ class CapitalType(Enum):
         return self.value
 
 
+CAPITAL_TYPES = list(CapitalType)   # the capital types, indexed by the capital code stored in the CityTable
+
+
+class CityTable():
+    """
+    Stores the data of every city in columns, one row per city:
+    float64 latitudes and longitudes, int country codes, capital type codes and int city IDs.
+    City instances are views onto a row of this table.
+    """
+
+    def __init__(self) -> None:
+        """
+        Creates an empty table.
+        """
+        self.size = 0                       # number of rows in use
+
+        self._latitudes = np.empty(0, dtype=np.float64)
+        self._longitudes = np.empty(0, dtype=np.float64)
+        self._country_codes = np.empty(0, dtype=np.int32)
+        self._capital_codes = np.empty(0, dtype=np.int8)
+        self._city_ids = np.empty(0, dtype=np.int64)
+        self.names = []                     # stores the city name of every row
+
+        self.country_names = []             # stores the country name of every country code
+        self._country_code_of = dict()      # a dict that associates country names to country codes
+
+    @property
+    def latitudes(self) -> np.ndarray:
+        return self._latitudes[:self.size]
+
+    @property
+    def longitudes(self) -> np.ndarray:
+        return self._longitudes[:self.size]
+
+    @property
+    def country_codes(self) -> np.ndarray:
+        return self._country_codes[:self.size]
+
+    @property
+    def capital_codes(self) -> np.ndarray:
+        return self._capital_codes[:self.size]
+
+    @property
+    def city_ids(self) -> np.ndarray:
+        return self._city_ids[:self.size]
+
+    def country_code(self, country_name: str) -> int:
+        """
+        Returns the code of a country name, giving a new code to names never seen before.
+        """
+        if country_name not in self._country_code_of:
+            self._country_code_of[country_name] = len(self.country_names)
+            self.country_names.append(country_name)
+
+        return self._country_code_of[country_name]
+
+    def _reserve(self, capacity: int) -> None:
+        """
+        Grows the columns (at least doubling them) so that they can hold the given number of rows.
+        """
+        if capacity <= len(self._latitudes):
+            return
+
+        capacity = max(capacity, 2 * len(self._latitudes), 64)
+        for column in ("_latitudes", "_longitudes", "_country_codes", "_capital_codes", "_city_ids"):
+            old = getattr(self, column)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, column, new)
+
+    def add_row(self, name: str, latitude: float, longitude: float, country: str, capital_type: CapitalType, city_id: int) -> int:
+        """
+        Adds a city at the end of the table and returns its row.
+        """
+        self._reserve(self.size + 1)
+
+        row = self.size
+        self._latitudes[row] = latitude
+        self._longitudes[row] = longitude
+        self._country_codes[row] = self.country_code(country)
+        self._capital_codes[row] = CAPITAL_TYPES.index(capital_type)
+        self._city_ids[row] = city_id
+        self.names.append(name)
+
+        self.size += 1
+        return row
+
+    def add_rows(self, names: list[str], latitudes: np.ndarray, longitudes: np.ndarray,
+                 country_codes: np.ndarray, capital_codes: np.ndarray, city_ids: np.ndarray) -> range:
+        """
+        Adds many cities at the end of the table at once (the country codes must come from country_code)
+        and returns their rows.
+        """
+        start, end = self.size, self.size + len(names)
+        self._reserve(end)
+
+        self._latitudes[start:end] = latitudes
+        self._longitudes[start:end] = longitudes
+        self._country_codes[start:end] = country_codes
+        self._capital_codes[start:end] = capital_codes
+        self._city_ids[start:end] = city_ids
+        self.names.extend(names)
+
+        self.size = end
+        return range(start, end)
+
+
 class Country():
     """
     Represents a country.
@@ -91,26 +201,75 @@ class Country():
 
 class City():
     """
-    Represents a city.
+    Represents a city, as a view onto a row of the CityTable City.table.
     """
 
+    __slots__ = ("row",)
+
     cities = dict() # a dict that associates city IDs to instances.
+    version = 0     # incremented every time a city is created, so that data derived from City.cities (e.g. graphs) can be invalidated
+    table = CityTable() # stores the data of every city created
 
     def __init__(self, name: str, latitude: str, longitude: str, country: str, capital_type: str, city_id: str) -> None:
         """
         Initialises a city with the given data.
+        The latitude, longitude and (numeric) city_id are parsed once and stored in City.table.
         """
-        self.name = name                                # stores city name
-        self.latitude = latitude                        # stores city latitude
-        self.longitude = longitude                      # stores city longitude
-        self.country = country                          # stores country name of the city
-        self.capital_type = CapitalType(capital_type)   # stores the enum capital type of the city
-        self.city_id = city_id                          # stores city_id
+        self.row = City.table.add_row(name, float(latitude), float(longitude), country, CapitalType(capital_type), int(city_id))
 
         City.cities.update({self.city_id:self}) # stores the ccity id (key) and city object (value) in cities dictionary
+        City.version += 1                       # marks the city set as changed
 
         Country._add_city(Country.countries[self.country], self)    # calls _add_city method from the Country class to add city to it's respective country when initialized
 
+    @classmethod
+    def from_rows(cls, rows: range) -> list[City]:
+        """
+        Creates the cities of rows that were added to City.table directly (e.g. with CityTable.add_rows)
+        and returns them.
+        """
+        cities = []
+        names = City.table.names[rows.start:rows.stop]
+        city_ids = City.table.city_ids[rows.start:rows.stop].tolist()
+        country_codes = City.table.country_codes[rows.start:rows.stop].tolist()
+        country_cities = [Country.countries[country_name].city if country_name in Country.countries else None
+                          for country_name in City.table.country_names]
+
+        # creates a view for every row without going through __init__, and registers it like __init__ and Country._add_city do
+        for row, name, city_id, country_code in zip(rows, names, city_ids, country_codes):
+            city = object.__new__(cls)
+            city.row = row
+            City.cities[str(city_id)] = city
+            country_cities[country_code][name] = city
+            cities.append(city)
+
+        City.version += 1   # marks the city set as changed
+        return cities
+
+    @property
+    def name(self) -> str:
+        return City.table.names[self.row]
+
+    @property
+    def latitude(self) -> float:
+        return float(City.table._latitudes[self.row])
+
+    @property
+    def longitude(self) -> float:
+        return float(City.table._longitudes[self.row])
+
+    @property
+    def country(self) -> str:
+        return City.table.country_names[City.table._country_codes[self.row]]
+
+    @property
+    def capital_type(self) -> CapitalType:
+        return CAPITAL_TYPES[City.table._capital_codes[self.row]]
+
+    @property
+    def city_id(self) -> str:
+        return str(City.table._city_ids[self.row])
+
     def distance(self, other_city: City) -> int:
         """
         Returns the distance in kilometers between two cities using the great circle method,
@@ -129,6 +288,163 @@ class City():
         """
         return self.name + " (" + Country.countries[self.country].ISO_code + ")"    # return city name and country ISO code
 
+def rows_of(cities: list[City]) -> np.ndarray:
+    """
+    Returns the rows of City.table of a list of cities, as an array.
+    """
+    return np.fromiter((city.row for city in cities), dtype=np.intp, count=len(cities))
+
+
+def cached_for_cities(cache: dict, key, build):
+    """
+    Returns the value stored in a cache under a key, after storing build() there if it was never stored
+    or if cities were created since.
+    """
+    cached = cache.get(key)
+    if cached is None or cached[0] != City.version:
+        cached = (City.version, build())
+        cache[key] = cached
+
+    return cached[1]
+
+
+_fingerprint = dict()   # a dict that associates None to a (City.version, hash) tuple of the last fingerprint computed
+
+
+def city_set_fingerprint() -> str:
+    """
+    Returns a hash of the data of every city of City.cities (in order), which identifies the city set
+    across processes, e.g. to check that data saved to disk was derived from the same cities.
+    """
+    return cached_for_cities(_fingerprint, None, _hash_cities)
+
+
+def _hash_cities() -> str:
+    """
+    Returns the hash of city_set_fingerprint.
+    """
+    rows = rows_of(list(City.cities.values()))
+    sha256 = hashlib.sha256()
+    for column in (City.table.city_ids, City.table.latitudes, City.table.longitudes, City.table.capital_codes):
+        sha256.update(np.ascontiguousarray(column[rows]).tobytes())
+
+    # the country names are hashed rather than the codes, which depend on the order countries were first seen in
+    sha256.update("\n".join(City.table.names[row] for row in rows.tolist()).encode('utf-8'))
+    sha256.update("\n".join(City.table.country_names[code] for code in City.table.country_codes[rows].tolist()).encode('utf-8'))
+    return sha256.hexdigest()
+
+
+SHARED_COLUMNS = ("latitudes", "longitudes", "country_codes", "capital_codes", "city_ids")  # the columns of City.table copied by share_cities
+
+
+def share_cities() -> (list[shared_memory.SharedMemory], dict):
+    """
+    Copies the numeric columns of City.table to shared memory blocks, so that other processes can create the same
+    cities with attach_shared_cities without the columns being pickled.
+    Returns the blocks (which the caller must close and unlink once the other processes are done)
+    and a (picklable) description of the cities, which holds the names of the blocks and the strings of the table.
+    """
+    blocks, columns = [], dict()
+
+    for column in SHARED_COLUMNS:
+        array = getattr(City.table, column)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        columns[column] = (block.name, array.dtype.str)
+
+    description = {"size": City.table.size, "columns": columns, "names": City.table.names,
+                   "country_names": City.table.country_names,
+                   "countries": [[country.country_name, country.ISO_code] for country in Country.countries.values()]}
+    return blocks, description
+
+
+def attach_shared_cities(description: dict) -> None:
+    """
+    Creates the countries and cities shared by share_cities in another process, in the same order
+    (so that City.cities and the rows of City.table are the same in both processes).
+    The columns are copied from the shared memory blocks, which are closed afterwards.
+    """
+    for country_name, iso3 in description["countries"]:
+        Country(country_name, iso3)
+    to_table_code = np.array([City.table.country_code(country_name) for country_name in description["country_names"]], dtype=np.int32)
+
+    blocks, columns = [], dict()
+    try:
+        for column in SHARED_COLUMNS:
+            name, dtype = description["columns"][column]
+            blocks.append(shared_memory.SharedMemory(name=name))
+            columns[column] = np.ndarray((description["size"],), dtype=np.dtype(dtype), buffer=blocks[-1].buf)
+
+        rows = City.table.add_rows(description["names"], columns["latitudes"], columns["longitudes"],
+                                   to_table_code[columns["country_codes"]], columns["capital_codes"], columns["city_ids"])
+    finally:
+        columns.clear()     # the views must be released before the blocks are closed
+        for block in blocks:
+            block.close()
+
+    City.from_rows(rows)
+
+
+def _trigonometry(cities: list[City]) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Returns the sine and cosine of the latitudes and the longitudes (in radians) of a list of cities, as arrays.
+    """
+    rows = rows_of(cities)
+    latitudes = np.radians(City.table.latitudes[rows])
+    longitudes = np.radians(City.table.longitudes[rows])
+
+    return np.sin(latitudes), np.cos(latitudes), longitudes
+
+
+def _great_circle_km(sin_lat1, cos_lat1, lng1, sin_lat2, cos_lat2, lng2) -> np.ndarray:
+    """
+    Returns the great circle distances in kilometers between arrays of points (broadcast against each other),
+    using the same formula and earth radius as geopy's great_circle.
+    """
+    delta_lng = lng2 - lng1
+    cos_delta_lng, sin_delta_lng = np.cos(delta_lng), np.sin(delta_lng)
+
+    d = np.arctan2(np.sqrt((cos_lat2 * sin_delta_lng) ** 2 +
+                           (cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_delta_lng) ** 2),
+                   sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lng)
+
+    return distance.EARTH_RADIUS * d
+
+
+def distance_matrix(cities_a: list[City], cities_b: list[City]) -> np.ndarray:
+    """
+    Returns a matrix of the distances in kilometers between every city of cities_a (rows) and every city of cities_b (columns),
+    rounded up to an integer like City.distance.
+    """
+    sin_lat_a, cos_lat_a, lng_a = _trigonometry(cities_a)
+    sin_lat_b, cos_lat_b, lng_b = _trigonometry(cities_b)
+
+    km = _great_circle_km(sin_lat_a[:, np.newaxis], cos_lat_a[:, np.newaxis], lng_a[:, np.newaxis],
+                          sin_lat_b[np.newaxis, :], cos_lat_b[np.newaxis, :], lng_b[np.newaxis, :])
+
+    return np.ceil(km).astype(np.int64)
+
+
+def pair_distances(cities_a: list[City], cities_b: list[City]) -> np.ndarray:
+    """
+    Returns an array of the distances in kilometers between every city of cities_a and the city at the same position
+    in cities_b, rounded up to an integer like City.distance.
+    """
+    sin_lat_a, cos_lat_a, lng_a = _trigonometry(cities_a)
+    sin_lat_b, cos_lat_b, lng_b = _trigonometry(cities_b)
+
+    return np.ceil(_great_circle_km(sin_lat_a, cos_lat_a, lng_a, sin_lat_b, cos_lat_b, lng_b)).astype(np.int64)
+
+
+def distances_from(city: City, cities: list[City]) -> np.ndarray:
+    """
+    Returns an array of the distances in kilometers from a city to every city of a list,
+    rounded up to an integer like City.distance.
+    """
+    return distance_matrix([city], cities)[0]
+
+
 def create_example_countries_and_cities() -> None:
     """
     Creates a few Countries and Cities for testing purposes.
@@ -10,8 +10,7 @@ from vehicles import CrappyCrepeCar, DiplomacyDonutDinghy, TeleportingTarteTroll
 
 from trip import Trip
 
-import path_finding
-from path_finding import find_shortest_path
+from path_finding import find_shortest_path_with_times
 
 from map_plotting import plot_trip
 
@@ -461,8 +460,7 @@ if opt == 1:
         if best_trip_time == math.inf or best_trip == None:
             print("The travel is not possible... Re-run the program to try again")  # if no trip available then print error message
         else:
-            index = vehicle_fleet.index(best_vehicle)  # get the index based on the vehicle of choice
-            time_list = best_trip.every_time_list[index]  # get the corresponding time based on the vehicle
+            time_list = best_trip.leg_times(best_vehicle).as_list()  # get the time of every leg for the best vehicle
             progress_bar(best_trip, best_vehicle, cities, time_list, best_trip_time)  # call progress bar function to output the progress bar
 
     else:
@@ -470,7 +468,7 @@ if opt == 1:
         best_vehicle = vehicle_fleet[index-1]                   # get the best vehicle based on the index from vehicle fleet
         best_trip_time = trip.total_travel_time(best_vehicle)   # compute the best travel time by calling the total_travel_time function from the trip class
         cities = trip.city_list                                 # get the cities list from the trip class instance variable
-        time_list = trip.every_time_list[0]                     # gets the time_list between two cities
+        time_list = trip.leg_times(best_vehicle).as_list()      # gets the time_list between two cities
 
         if best_trip_time == math.inf:
             print("The travel is not possible... Re-run the program to try again")
@@ -509,8 +507,7 @@ elif opt == 2:
         if best_trip_time == math.inf or best_trip == None:
             print("The travel is not possible... Re-run the program to try again")  # if no trip available then print error message
         else:
-            index = vehicle_fleet.index(best_vehicle)  # get the index based on the vehicle of choice
-            time_list = best_trip.every_time_list[index]  # get the corresponding time based on the vehicle
+            time_list = best_trip.leg_times(best_vehicle).as_list()  # get the time of every leg for the best vehicle
             progress_bar(best_trip, best_vehicle, cities, time_list, best_trip_time)  # call progress bar function to output the progress bar
 
     else:
@@ -518,7 +515,7 @@ elif opt == 2:
         best_vehicle = vehicle_fleet[index-1]                   # get the best vehicle based on the index from vehicle fleet
         best_trip_time = trip.total_travel_time(best_vehicle)   # compute the best travel time by calling the total_travel_time function from the trip class
         cities = trip.city_list                                 # get the cities list from the trip class instance variable
-        time_list = trip.every_time_list[0]                     # gets the time_list between two cities
+        time_list = trip.leg_times(best_vehicle).as_list()      # gets the time_list between two cities
 
         if best_trip_time == math.inf:
             print("The travel is not possible... Re-run the program to try again")
@@ -537,14 +534,11 @@ else:
     # for every vehicle in the vehicle list, compute the shortest path trip, store the trip in trip_list and get prints the shortest path, path, vehc type and time
     i = 1
     for vehc in vehicle_fleet:
-        trip = find_shortest_path(vehc, city1, city2)
+        trip, time_list, total_time = find_shortest_path_with_times(vehc, city1, city2)
         trip_list.append(trip)
         print("Shortest Path " + str(i))
         print("~~> Path: " + str(trip))
-        if path_finding.valid_time_list[i - 1] == math.inf:
-            travel_time_list.append(math.inf)
-        else:
-            travel_time_list.append(sum(path_finding.valid_time_list[i - 1]))
+        travel_time_list.append(total_time)
         i += 1
     print("")
 
@@ -575,8 +569,7 @@ else:
             if best_trip_time == math.inf:
                 print("The travel is not possible... Re-run the program to try again")  # if no trip available then print error message
             else:
-                index = vehicle_fleet.index(best_vehicle)  # get the index based on the vehicle of choice
-                time_list = best_trip.every_time_list[index]  # get the corresponding time based on the vehicle
+                time_list = best_trip.leg_times(best_vehicle).as_list()  # get the time of every leg for the best vehicle
                 progress_bar(best_trip, best_vehicle, cities, time_list, best_trip_time)  # call progress bar function to output the progress bar
 
     else:
@@ -587,7 +580,7 @@ else:
             best_vehicle = vehicle_fleet[index-1]                   # get the best vehicle based on the index from vehicle fleet
             best_trip_time = best_trip.total_travel_time(best_vehicle)   # compute the best travel time by calling the total_travel_time function from the trip class
             cities = best_trip.city_list                                 # get the cities list from the trip class instance variable
-            time_list = best_trip.every_time_list[0]                     # gets the time_list between two cities
+            time_list = best_trip.leg_times(best_vehicle).as_list()      # gets the time_list between two cities
 
             if best_trip_time == math.inf:
                 print("The travel is not possible... Re-run the program to try again")
@@ -1,70 +1,1267 @@
+from __future__ import annotations
+
+import heapq
+import itertools
 import math
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import city_country_csv_reader
-from locations import City, Country
+from contraction_hierarchy import ContractionHierarchy, HubTable
+from csr_graph import CSRGraph
+from locations import City, Country, attach_shared_cities, cached_for_cities, city_set_fingerprint, rows_of, share_cities
+from spatial_index import get_spatial_index, unit_vectors, within_distances
 from trip import Trip
-from vehicles import Vehicle, create_example_vehicles
+from vehicles import RoutingCapability, TeleportingTarteTrolley, Vehicle, as_hours, create_example_vehicles
 import networkx
+import numpy as np
+
+graph_cache = dict()      # a dict that associates a vehicle signature (str(vehicle)) to a (City.version, graph) tuple
+graph_directory = None    # when set, the graphs of the vehicles are saved to this directory in CSR form and memory-mapped from it
+component_cache = dict()  # a dict that associates a vehicle signature (str(vehicle)) to a (City.version, Components) tuple
+
+hierarchy_directory = None  # when set, shortest paths are searched with the contraction hierarchies saved in this directory, if any
+hierarchy_cache = dict()    # a dict that associates a vehicle signature (str(vehicle)) to a (City.version, ContractionHierarchy or None) tuple
 
-valid_time_list = [] # stores the time taken between cities (list in a list) for each vehicle passed (required for Task 7)
+LARGE_GROUP_SIZE = 5000  # the size above which the legs from a city to a whole group are neither compared between two vehicles
+                         # nor computed once the time left is bounded (see GroupGraph.neighbours)
 
-def find_shortest_path(vehicle: Vehicle, from_city: City, to_city: City) -> Trip:
+
+class GroupGraph():
     """
-    Returns a shortest path between two cities for a given vehicle,
-    or None if there is no path.
+    A vehicle graph whose edges are not stored: two cities are connected if they belong to a same group
+    (see Vehicle.leg_groups), and the travel times are computed when the neighbours of a city are needed.
+    Its memory is proportional to the number of cities rather than the number of edges.
     """
 
+    def __init__(self, vehicle: Vehicle, groups: list[list[City]], direct: list[bool] = None) -> None:
+        """
+        Creates the graph of a vehicle from the groups of cities it connects, and whether a direct trip within
+        each group is never slower than going through other cities of the group (see Vehicle.leg_group_is_direct).
+        """
+        self.vehicle = vehicle      # stores the vehicle computing the travel times
+        self.groups = groups        # stores the lists of cities connected to each other
+        self.direct = [vehicle.leg_group_is_direct(group) for group in groups] if direct is None else direct
+        self.group_rows = [rows_of(group) for group in groups]  # stores the rows of City.table of the cities of every group
+        # stores the unit vectors of the cities of every large group, by group index (see neighbours)
+        self.group_points = {group_index: unit_vectors(group) for group_index, group in enumerate(groups) if len(group) > LARGE_GROUP_SIZE}
+        self.groups_of = dict()     # a dict that associates every city to the indexes of the groups it belongs to
+        self.positions_of = dict()  # a dict that associates every city to its position in each of these groups
+        self.faster_legs = dict()   # a dict that associates a (vehicle signature, group index) pair to the cities of the group
+                                    # with a leg that this vehicle travels faster than the other one (see has_faster_legs)
+
+        for group_index, group in enumerate(groups):
+            for position, city in enumerate(group):
+                self.groups_of.setdefault(city, []).append(group_index)
+                self.positions_of.setdefault(city, []).append(position)
+
+    def has_faster_legs(self, other_vehicle: Vehicle, group_index: int) -> np.ndarray | None:
+        """
+        Returns whether every city of a group has a leg within the group that the vehicle of the graph travels
+        strictly faster than other_vehicle, computed once per vehicle, or None if the group is too large to compare every pair.
+        """
+        key = (str(other_vehicle), group_index)
+        if key not in self.faster_legs:
+            group = self.groups[group_index]
+            faster = None
+            if len(group) <= LARGE_GROUP_SIZE:
+                faster = np.zeros(len(group), dtype=bool)
+                for start in range(0, len(group), 256):  # compares a few rows at a time to bound the memory used
+                    departures = group[start:start + 256]
+                    times = self.vehicle.travel_time_matrix(departures, group)
+                    faster[start:start + 256] = np.any(times < other_vehicle.travel_time_matrix(departures, group), axis=1)
+            self.faster_legs[key] = faster
+        return self.faster_legs[key]
+
+    def neighbours(self, city: City, previous_city: City = None, max_leg_time: float = math.inf, lower_bounds: np.ndarray = None,
+                   switched_from: Vehicle = None, arrival_times: np.ndarray = None, departure_time: float = 0):
+        """
+        Yields every (neighbour, travel time) pair of a city, leaving out the travel times above max_leg_time,
+        or, if lower_bounds (an array of a bound of the time left from every row of City.table) is given,
+        the ones above max_leg_time once the bound of their neighbour is added.
+        If the city was reached from previous_city, the direct groups they share are skipped, as every city of these groups
+        is reached at least as fast from previous_city itself.
+        If the trip changed to this vehicle in the city from the vehicle switched_from, the neighbours that switched_from
+        reaches at least as fast are left out, as changing vehicle in them instead is never slower.
+        If arrival_times (the best known arrival time with the vehicle in every row of City.table) is given,
+        the neighbours that are not reached sooner when leaving the city at departure_time are left out.
+        The neighbours of large groups are first narrowed down by distance once max_leg_time bounds the distance of a leg
+        (see Vehicle.max_leg_distance).
+        """
+        previous_groups = self.groups_of.get(previous_city, []) if previous_city is not None else []
+
+        for group_index, position in zip(self.groups_of.get(city, []), self.positions_of.get(city, [])):
+            if self.direct[group_index] and group_index in previous_groups:
+                continue
+            if switched_from is not None:
+                faster = self.has_faster_legs(switched_from, group_index)
+                if faster is not None and not faster[position]:
+                    continue
+
+            # the neighbours of a large group are only looked for within the distance the vehicle covers in the time left
+            # to each of them, found from their unit vectors so that the travel times are only computed for the cities left
+            group, rows = self.groups[group_index], self.group_rows[group_index]
+            if len(group) > LARGE_GROUP_SIZE and self.vehicle.max_leg_distance(max_leg_time) != math.inf:
+                time_left = np.full(len(rows), max_leg_time) if lower_bounds is None else max_leg_time - lower_bounds[rows]
+                if arrival_times is not None:
+                    time_left = np.minimum(time_left, arrival_times[rows] - departure_time)
+                nearby = within_distances(self.group_points[group_index], city, self.vehicle.max_leg_distances(time_left))
+                group, rows = [group[index] for index in nearby.tolist()], rows[nearby]
+
+            times = self.vehicle.travel_time_matrix([city], group)[0]   # the travel times to the whole group at once
+            possible = times != math.inf
+            if max_leg_time != math.inf:
+                possible &= times <= (max_leg_time if lower_bounds is None else max_leg_time - lower_bounds[rows])
+            if arrival_times is not None:
+                possible &= times < arrival_times[rows] - departure_time
+            if switched_from is not None:
+                candidates = np.flatnonzero(possible)
+                possible[candidates] = times[candidates] < switched_from.travel_time_matrix([city], [group[index] for index in candidates.tolist()])[0]
+            neighbour_indexes = np.flatnonzero(possible)
+
+            # whole numbers of hours are converted to int all at once rather than one by one with as_hours
+            leg_times = times[neighbour_indexes]
+            if np.array_equal(leg_times, np.floor(leg_times)):
+                leg_times = leg_times.astype(np.int64).tolist()
+            else:
+                leg_times = [as_hours(leg_time) for leg_time in leg_times.tolist()]
+
+            for neighbour_index, leg_time in zip(neighbour_indexes.tolist(), leg_times):
+                if group[neighbour_index] is not city:
+                    yield group[neighbour_index], leg_time
+
+
+def build_vehicle_graph(vehicle: Vehicle) -> networkx.Graph | GroupGraph:
+    """
+    Builds a graph with every city of City.cities as a node and an edge (weighted by the travel time)
+    between every pair of cities that the given vehicle can travel between directly.
+    Returns a GroupGraph instead if the vehicle has leg groups or RoutingCapability.direct.
+    """
+
+    # gets the cities once, so that each pair below is looked up by index in constant time
+    city_list = list(City.cities.values())
+
+    # if the vehicle connects groups of cities, the edges are generated on demand rather than stored
+    groups = vehicle.leg_groups(city_list)
+    if groups is not None:
+        return GroupGraph(vehicle, groups)
+
+    # a vehicle whose direct trip is always a shortest path may connect every pair of cities,
+    # so its graph is a single group (in which a direct trip is never slower than several) rather than a stored edge for every pair
+    if vehicle.routing_capability() == RoutingCapability.direct:
+        return GroupGraph(vehicle, [city_list], [True])
+
     # calls the Graph function in networkx and stores in G
     G = networkx.Graph()
 
     # add all cities found as the nodes (names of the cities)
-    for city in City.cities.values():
-        G.add_node(city)
+    G.add_nodes_from(city_list)
+
+    max_leg_distance = vehicle.max_leg_distance()
+    if max_leg_distance != math.inf:
+        index = get_spatial_index()
+
+    for city_index_1, city1_val in enumerate(city_list):
+
+        # if the vehicle has a maximum leg distance, only the cities found by a radius query of the spatial index are checked,
+        # otherwise every city after this one (so that every pair of cities is checked once)
+        if max_leg_distance != math.inf:
+            candidates = [city2_val for city2_val in index.cities_within(city1_val, max_leg_distance) if city2_val.row > city1_val.row]
+        else:
+            candidates = city_list[city_index_1 + 1:]
+
+        # compute the valid times to every candidate at once by calling the travel_time_matrix method
+        valid_times = vehicle.travel_time_matrix([city1_val], candidates)[0]
+
+        # as long as valid_time is not math.inf, add edges between corresponding cities and it's valid_time as the weight
+        for city_index_2 in np.flatnonzero(valid_times != math.inf).tolist():
+            G.add_edge(city1_val, candidates[city_index_2], weight=as_hours(valid_times[city_index_2]))
+
+    return G
+
+
+def get_vehicle_graph(vehicle: Vehicle) -> networkx.Graph | GroupGraph | CSRGraph:
+    """
+    Returns the graph of a given vehicle over all cities.
+    The graph is built once per vehicle parameters and city set, then reused until a city is created.
+    """
+    build = build_vehicle_graph if graph_directory is None else _load_or_save_vehicle_graph
+    return cached_for_cities(graph_cache, str(vehicle), lambda: build(vehicle))
+
+
+def graph_path(vehicle: Vehicle, directory: str) -> str:
+    """
+    Returns the path of the directory of the CSR graph of a vehicle over the current cities in a directory,
+    e.g. "TeleportingTarteTrolley_3_h_2000_km_0123456789abcdef", ending with the start of the fingerprint of the cities
+    so that the graphs of other city sets are saved next to it rather than over it.
+    """
+    return os.path.join(directory, "{}_{}".format(_file_name(vehicle), city_set_fingerprint()[:16]))
+
+
+def _load_or_save_vehicle_graph(vehicle: Vehicle) -> networkx.Graph | GroupGraph | CSRGraph:
+    """
+    Returns the graph of a vehicle memory-mapped from graph_directory, building and saving it first
+    if it was never saved for these vehicle parameters and cities.
+    Graphs whose edges are generated on demand (GroupGraph) are not saved.
+    """
+    path = graph_path(vehicle, graph_directory)
+    cities = list(City.cities.values())
+    signature = _graph_signature(vehicle)
+
+    graph = CSRGraph.load(path, cities, signature)
+    if graph is None:
+        graph = build_vehicle_graph(vehicle)
+        if isinstance(graph, networkx.Graph):
+            csr_graph = CSRGraph.from_graph(graph, cities, signature)
+            csr_graph.save(path)
+
+            # the graph is memory-mapped from the directory, unless it holds another graph that was kept (see CSRGraph.save)
+            graph = CSRGraph.load(path, cities, signature) or csr_graph
+
+    return graph
+
+
+class Components():
+    """
+    The connected components of the graph of a vehicle: there is a path between two cities
+    if and only if they are in the same component.
+    """
+
+    def __init__(self, label_of: dict, members: list[list[City]]) -> None:
+        """
+        Creates the components from the label of every city and the list of cities of every label.
+        """
+        self.label_of = label_of    # a dict that associates every city to the label (index) of its component
+        self.members = members      # stores the list of cities of every component
+
+    def connected(self, city1: City, city2: City) -> bool:
+        """
+        Returns whether there is a path between two cities.
+        """
+        label = self.label_of.get(city1)
+        return label is not None and label == self.label_of.get(city2)
+
+    def component_of(self, city: City) -> list[City]:
+        """
+        Returns the cities of the component of a city (including itself).
+        """
+        label = self.label_of.get(city)
+        return [city] if label is None else self.members[label]
+
+
+def find_components(vehicle: Vehicle) -> Components:
+    """
+    Finds the connected components of the graph of a vehicle with a union-find over its direct trips:
+    every city is connected to all others for RoutingCapability.direct, to the cities of its groups for vehicles
+    with leg groups, and to its neighbours in the graph otherwise.
+    """
+
+    city_list = list(City.cities.values())
+    index_of = {city: index for index, city in enumerate(city_list)}
+    parent = list(range(len(city_list)))    # the parent of every city (by index) in the union-find forest
+
+    def find(index: int) -> int:
+        # follows the parents up to the root, halving the path on the way
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def union(index1: int, index2: int) -> None:
+        root1, root2 = find(index1), find(index2)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+
+    if vehicle.routing_capability() == RoutingCapability.direct:
+        for index in range(1, len(city_list)):
+            union(0, index)
+    else:
+        graph = get_vehicle_graph(vehicle)
+        if isinstance(graph, GroupGraph):
+            for group in graph.groups:
+                for city in group[1:]:
+                    union(index_of[group[0]], index_of[city])
+        else:
+            for city1, city2 in graph.edges():
+                union(index_of[city1], index_of[city2])
+
+    # gives every root a label, in the order of the cities
+    label_of_root = dict()
+    label_of = dict()
+    members = []
+    for index, city in enumerate(city_list):
+        root = find(index)
+        if root not in label_of_root:
+            label_of_root[root] = len(members)
+            members.append([])
+        label_of[city] = label_of_root[root]
+        members[label_of[city]].append(city)
+
+    return Components(label_of, members)
+
+
+def get_components(vehicle: Vehicle) -> Components:
+    """
+    Returns the connected components of the graph of a given vehicle over all cities.
+    They are found once per vehicle parameters and city set, then reused until a city is created.
+    """
+    return cached_for_cities(component_cache, str(vehicle), lambda: find_components(vehicle))
+
+
+def reachable_cities(vehicle: Vehicle, city: City) -> list[City]:
+    """
+    Returns every city that a given vehicle can reach from a city (including the city itself).
+    """
+    return get_components(vehicle).component_of(city)
+
+
+def _graph_signature(vehicle: Vehicle) -> str:
+    """
+    Returns the signature of the graph (or contraction hierarchy) of a vehicle over the current cities.
+    """
+    return str(vehicle) + " | " + city_set_fingerprint()
+
+
+def _file_name(vehicle: Vehicle) -> str:
+    """
+    Returns the parameters of a vehicle as a file name, e.g. "TeleportingTarteTrolley_3_h_2000_km".
+    """
+    return re.sub(r'[^A-Za-z0-9]+', '_', str(vehicle)).strip('_')
+
+
+def hierarchy_path(vehicle: Vehicle, directory: str) -> str:
+    """
+    Returns the path of the file of the contraction hierarchy of a vehicle over the current cities in a directory,
+    e.g. "TeleportingTarteTrolley_3_h_2000_km_0123456789abcdef.npz", named like the graphs (see graph_path).
+    """
+    return graph_path(vehicle, directory) + ".npz"
 
-    for city_index_1 in range(len(City.cities)):
-        # loops through every pair of cities possible to check if a path exists
-        for city_index_2 in range(city_index_1, len(City.cities)):
-            if city_index_1 != city_index_2:
 
-                # gets two cities
-                city1_val = list(City.cities.values())[city_index_1]   # corresponds to the index of first loop
-                city2_val = list(City.cities.values())[city_index_2]   # corresponds to the index of second loop
+def build_contraction_hierarchy(vehicle: Vehicle, directory: str = None) -> ContractionHierarchy | HubTable:
+    """
+    Builds the contraction hierarchy of the graph of a vehicle over all cities and saves it in a directory
+    (hierarchy_directory by default), where find_shortest_path will use it.
+    For vehicles whose edges are generated on demand (GroupGraph), contracting would store every edge of their groups,
+    so the table of the travel times between the hubs of the groups (see HubTable) is built instead.
+    """
+    graph = get_vehicle_graph(vehicle)
+    if isinstance(graph, GroupGraph):
+        hierarchy = HubTable.build(vehicle, list(City.cities.values()), graph.groups, graph.direct, _graph_signature(vehicle))
+    else:
+        hierarchy = ContractionHierarchy.build(list(City.cities.values()), lambda city: _neighbours(graph, city), _graph_signature(vehicle))
 
-                # compute the valid time for given vehicle by calling compute_travel_time method
-                valid_time = vehicle.compute_travel_time(city1_val, city2_val)
+    directory = hierarchy_directory if directory is None else directory
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        hierarchy.save(hierarchy_path(vehicle, directory))
 
-                # as long as valid_time is not math.inf, add edges between corresponding cities and it's valid_time as the weight
-                if valid_time != math.inf:
-                    G.add_edge(city1_val, city2_val, weight=valid_time)
+    hierarchy_cache[str(vehicle)] = (City.version, hierarchy)
+    return hierarchy
 
-    # if the given source and target city has a path, find the shortest path and corresponding path_trip
-    if networkx.has_path(G, source=from_city, target=to_city):
 
-        # finds the shortest path between both cities and it's weight (time)
-        short_path_list = networkx.shortest_path(G, source=from_city, target=to_city, weight='weight')
+def get_contraction_hierarchy(vehicle: Vehicle) -> ContractionHierarchy | HubTable | None:
+    """
+    Returns the contraction hierarchy (or hub table) of a vehicle saved in hierarchy_directory,
+    or None if there is none for this vehicle and these cities.
+    """
 
-        # gets the first city (departure) and creates aa Trip
-        dept = short_path_list[0]
-        path_trip = Trip(dept)
+    if hierarchy_directory is None:
+        return None
+    return cached_for_cities(hierarchy_cache, str(vehicle), lambda: _load_contraction_hierarchy(vehicle))
 
-        time_list = []  # time_list to store corresponding time between 2 cities
 
-        # loops through every cities, get the next city name, add the next city to the trip, store the time taken between 2 cities in time_list
-        for city_index_1 in range(1, len(short_path_list)):
-            path_trip.add_next_city(short_path_list[city_index_1])
-            time_list.append(networkx.shortest_path_length(G, source=short_path_list[city_index_1-1], target=short_path_list[city_index_1], weight='weight'))
+def _load_contraction_hierarchy(vehicle: Vehicle) -> ContractionHierarchy | HubTable | None:
+    """
+    Loads the contraction hierarchy (or hub table) of a vehicle from hierarchy_directory, ignoring it if it is missing,
+    damaged or built for other cities.
+    """
+    path = hierarchy_path(vehicle, hierarchy_directory)
+    hierarchy = ContractionHierarchy.load(path) or HubTable.load(path, vehicle)
+    if hierarchy is not None and hierarchy.signature != _graph_signature(vehicle):
+        hierarchy = None
 
-        # stores the time_list in variable outside the method called valid_time_list
-        valid_time_list.append(time_list)
+    return hierarchy
 
-        # returns the corresponding trip
-        return path_trip
 
+def _neighbours(graph: networkx.Graph | GroupGraph | CSRGraph, city: City, previous_city: City = None,
+                max_leg_time: float = math.inf, lower_bounds: np.ndarray = None, switched_from: Vehicle = None,
+                arrival_times: np.ndarray = None, departure_time: float = 0):
+    """
+    Yields every (neighbour, travel time) pair of a city in a vehicle graph.
+    If the city was reached from previous_city on a shortest path, the neighbours reached at least as fast
+    from previous_city may be left out (see GroupGraph.neighbours), and so may the travel times above max_leg_time
+    (once the lower bound of their neighbour is added, if lower_bounds is given)
+    and the trips that switched_from makes at least as fast, if the trip changed from it in the city,
+    and the trips that do not arrive sooner than arrival_times when leaving at departure_time.
+    """
+    if isinstance(graph, networkx.Graph):
+        for neighbour, edge in graph.adj[city].items():
+            yield neighbour, edge['weight']
+    elif isinstance(graph, GroupGraph):
+        yield from graph.neighbours(city, previous_city, max_leg_time, lower_bounds, switched_from, arrival_times, departure_time)
     else:
-        # if no trip possible, stores math.inf in valid_time_list and returns None
-        valid_time_list.append(math.inf)
+        yield from graph.neighbours(city)
+
+
+def _walk_back(previous: dict, leg_times: dict, city: City) -> (list[City], list[float]):
+    """
+    Returns the list of cities of the path to a city and the travel time of each of its legs,
+    by walking back from the city through the previous city of every city on the path.
+    """
+    path, path_leg_times = [], []
+    while previous[city] is not None:
+        path.append(city)
+        path_leg_times.append(leg_times[city])
+        city = previous[city]
+    path.append(city)
+    path.reverse()
+    path_leg_times.reverse()
+
+    return path, path_leg_times
+
+
+class SearchStats():
+    """
+    Statistics of a shortest path search, filled by find_shortest_path_with_times when given.
+    """
+
+    def __init__(self) -> None:
+        """
+        Creates empty statistics.
+        """
+        self.method = None              # stores the name of the search used
+        self.settled_forward = 0        # stores the number of cities settled by the search from the departure city
+        self.settled_backward = 0       # stores the number of cities settled by the search from the destination city (bidirectional only)
+
+    def __str__(self) -> str:
+        """
+        Returns a summary of the statistics.
+        """
+        return "{}: {} cities settled forward, {} backward".format(self.method, self.settled_forward, self.settled_backward)
+
+
+def _a_star(vehicle: Vehicle, graph: networkx.Graph | GroupGraph | CSRGraph, from_city: City, to_city: City,
+            stats: SearchStats = None, excluded: set = None, excluded_legs: set = None,
+            heuristic: dict = None, max_time: float = math.inf) -> (list[City], list[float]) | None:
+    """
+    Runs an A* search from one city to another over a vehicle graph, using the lower bound of the travel time
+    given by the vehicle (vehicle.lower_bound_travel_time) as the heuristic.
+    If the heuristic is not consistent, a city settled before its shortest path was found is queued again once it is,
+    so the path stays a shortest one.
+    If stats are given, the number of cities settled is added to them.
+    The search avoids the cities of excluded and the (city, next city) legs of excluded_legs, if given.
+    A heuristic dict from a previous search to the same city may be given to reuse the heuristics it computed.
+    The search gives up once every path left takes longer than max_time.
+
+    Returns the list of cities of a shortest path and the travel time of each of its legs, or None if there is no path.
+    """
+
+    if heuristic is None:
+        heuristic = {to_city: 0}            # the heuristic of every city reached so far, so that it is computed only once per city
+    best_time = {from_city: 0}              # the best known time from from_city to every city reached so far
+    previous = {from_city: None}            # the city before every city reached so far on its best known path
+    leg_times = {from_city: None}           # the travel time from the previous city of every city reached so far
+    settled = set()                         # the cities whose neighbours were relaxed with their best known time
+    tie_breaker = itertools.count()         # keeps the heap from comparing City objects when the times are equal
+
+    if from_city not in heuristic:
+        heuristic[from_city] = vehicle.lower_bound_travel_time(from_city, to_city)
+    open_heap = [(heuristic[from_city], 0, next(tie_breaker), from_city)]   # (estimate, -time, tie breaker, city) entries
+
+    while open_heap:
+        estimate, negative_time, _, city = heapq.heappop(open_heap)
+        time = -negative_time
+
+        # skips outdated entries of cities that were already reached faster
+        if city in settled:
+            continue
+
+        # the estimates are lower bounds, so every path left takes longer than max_time
+        if estimate > max_time:
+            return None
+
+        # once the destination is popped its time is optimal, so the path is rebuilt by walking back from it
+        if city is to_city:
+            return _walk_back(previous, leg_times, city)
+
+        settled.add(city)
+        if stats is not None:
+            stats.settled_forward += 1
+
+        # relaxes every direct trip leaving the city (the legs skipped from previous cities may be excluded, so none are skipped then)
+        previous_city = previous[city] if excluded is None and excluded_legs is None else None
+        for neighbour, leg_time in _neighbours(graph, city, previous_city):
+            if excluded is not None and neighbour in excluded:
+                continue
+            if excluded_legs is not None and (city, neighbour) in excluded_legs:
+                continue
+
+            # a settled city can only be reached faster if the heuristic is not consistent, and is then settled again
+            new_time = time + leg_time
+            if new_time < best_time.get(neighbour, math.inf):
+                settled.discard(neighbour)
+                best_time[neighbour] = new_time
+                previous[neighbour] = city
+                leg_times[neighbour] = leg_time
+                if neighbour not in heuristic:
+                    heuristic[neighbour] = vehicle.lower_bound_travel_time(neighbour, to_city)
+                # among equal estimates the city reached with the longest time is popped first, as it is the closest to the destination
+                heapq.heappush(open_heap, (new_time + heuristic[neighbour], -new_time, next(tie_breaker), neighbour))
+
+    # the destination was never reached
+    return None
+
+
+class _NonIntegralWeight(Exception):
+    """
+    Raised by the bucket queue search when it meets a travel time that is not a whole number of hours.
+    """
+
+
+def _dial(vehicle: Vehicle, graph: networkx.Graph | GroupGraph | CSRGraph, from_city: City, to_city: City,
+          stats: SearchStats = None) -> (list[City], list[float]) | None:
+    """
+    Runs an A* search from one city to another over a vehicle graph with Dial's bucket queue instead of a binary heap.
+    As travel times are whole numbers of hours, and so is the heuristic once rounded up (which keeps it a lower bound),
+    the cities are kept in one bucket per integer estimate, and the buckets are visited in increasing order
+    (jumping over the estimates no city is queued with, so that long travel times do not make the search slower).
+    If the heuristic is not consistent, a city may be queued with a lower estimate than the bucket being visited,
+    which is then visited again, and a city settled before its shortest path was found is queued again once it is.
+    Raises _NonIntegralWeight if a travel time is not a whole number of hours.
+    If stats are given, the number of cities settled is added to them.
+
+    Returns the list of cities of a shortest path and the travel time of each of its legs, or None if there is no path.
+    """
+
+    heuristic = {to_city: 0}                # the (rounded up) heuristic of every city reached so far
+    best_time = {from_city: 0}              # the best known time from from_city to every city reached so far
+    previous = {from_city: None}            # the city before every city reached so far on its best known path
+    leg_times = {from_city: None}           # the travel time from the previous city of every city reached so far
+    settled = set()                         # the cities whose neighbours were relaxed with their best known time
+
+    heuristic[from_city] = math.ceil(vehicle.lower_bound_travel_time(from_city, to_city))
+    key = heuristic[from_city]              # the estimate of the bucket being visited
+    buckets = {key: [from_city]}            # a dict that associates estimates to the list of cities queued with it
+    keys = [key]                            # a heap of the estimates of the buckets, so that the empty estimates are skipped
+    queued = 1                              # the number of entries in all buckets
+
+    while queued:
+        bucket = buckets.get(key)
+
+        # moves on to the lowest estimate queued once the bucket is empty
+        if not bucket:
+            buckets.pop(key, None)
+            key = heapq.heappop(keys)
+            while key not in buckets:
+                key = heapq.heappop(keys)
+            continue
+
+        city = bucket.pop()
+        queued -= 1
+
+        # skips outdated entries of cities that were already reached faster
+        if city in settled or best_time[city] + heuristic[city] != key:
+            continue
+
+        # once the destination is popped its time is optimal, so the path is rebuilt by walking back from it
+        if city is to_city:
+            return _walk_back(previous, leg_times, city)
+
+        settled.add(city)
+        if stats is not None:
+            stats.settled_forward += 1
+
+        # relaxes every direct trip leaving the city
+        for neighbour, leg_time in _neighbours(graph, city, previous[city]):
+            if leg_time != int(leg_time):
+                raise _NonIntegralWeight(leg_time)
+
+            # a settled city can only be reached faster if the heuristic is not consistent, and is then settled again
+            new_time = best_time[city] + leg_time
+            if new_time < best_time.get(neighbour, math.inf):
+                settled.discard(neighbour)
+                best_time[neighbour] = new_time
+                previous[neighbour] = city
+                leg_times[neighbour] = leg_time
+                if neighbour not in heuristic:
+                    heuristic[neighbour] = math.ceil(vehicle.lower_bound_travel_time(neighbour, to_city))
+                estimate = int(new_time + heuristic[neighbour])
+                if estimate not in buckets:
+                    buckets[estimate] = []
+                    heapq.heappush(keys, estimate)
+                buckets[estimate].append(neighbour)
+                queued += 1
+
+                # the estimate is below the bucket being visited only if the heuristic is not consistent,
+                # and the bucket being visited is then visited again afterwards
+                if estimate < key:
+                    heapq.heappush(keys, key)
+                    key = estimate
+
+    # the destination was never reached
+    return None
+
+
+def _bidirectional_dijkstra(graph: networkx.Graph | GroupGraph | CSRGraph, from_city: City, to_city: City,
+                            stats: SearchStats = None) -> (list[City], list[float]) | None:
+    """
+    Runs a Dijkstra search from each of two cities over a vehicle graph (whose direct trips take the same time
+    both ways) until they meet in the middle, which settles far fewer cities than a single search on long paths.
+    Every step advances the search whose next city is the closest, and the searches stop once the two closest cities
+    add up to at least the shortest path found so far.
+    If stats are given, the number of cities settled by each search is added to them.
+
+    Returns the list of cities of a shortest path and the travel time of each of its legs, or None if there is no path.
+    """
+
+    best_time = ({from_city: 0}, {to_city: 0})          # the best known time from each end to every city reached so far
+    previous = ({from_city: None}, {to_city: None})     # the city before every city reached so far, seen from each end
+    leg_times = ({from_city: None}, {to_city: None})    # the travel time from the previous city of every city reached so far
+    settled = (set(), set())                            # the cities whose best time from each end is final
+    tie_breaker = itertools.count()                     # keeps the heaps from comparing City objects when the times are equal
+    heaps = ([(0, next(tie_breaker), from_city)], [(0, next(tie_breaker), to_city)])
+    shortest, meeting = math.inf, None                  # the shortest path found so far and the city where its two halves meet
+
+    while heaps[0] and heaps[1]:
+        # no path through a city not yet settled by either search can be shorter
+        if heaps[0][0][0] + heaps[1][0][0] >= shortest:
+            break
+
+        direction = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        time, _, city = heapq.heappop(heaps[direction])
+
+        # skips outdated entries of cities that were already reached faster
+        if city in settled[direction]:
+            continue
+
+        settled[direction].add(city)
+        if stats is not None:
+            if direction == 0:
+                stats.settled_forward += 1
+            else:
+                stats.settled_backward += 1
+
+        # relaxes every direct trip leaving the city, and joins the halves wherever the other search reached it
+        for neighbour, leg_time in _neighbours(graph, city, previous[direction][city]):
+            new_time = time + leg_time
+            if neighbour not in settled[direction] and new_time < best_time[direction].get(neighbour, math.inf):
+                best_time[direction][neighbour] = new_time
+                previous[direction][neighbour] = city
+                leg_times[direction][neighbour] = leg_time
+                heapq.heappush(heaps[direction], (new_time, next(tie_breaker), neighbour))
+
+            other_time = best_time[1 - direction].get(neighbour)
+            if other_time is not None and best_time[direction][neighbour] + other_time < shortest:
+                shortest, meeting = best_time[direction][neighbour] + other_time, neighbour
+
+    if meeting is None:
         return None
 
+    # the first half is walked back to from_city, the second half is followed forward to to_city
+    path, path_leg_times = _walk_back(previous[0], leg_times[0], meeting)
+    city = meeting
+    while previous[1][city] is not None:
+        path_leg_times.append(leg_times[1][city])
+        city = previous[1][city]
+        path.append(city)
+
+    return path, path_leg_times
+
+
+def _breadth_first(graph: networkx.Graph | GroupGraph | CSRGraph, from_city: City, to_cities: set = None,
+                   max_time: float = math.inf) -> (dict, dict, dict):
+    """
+    Runs a breadth first search from a city over a vehicle graph, which finds the paths with the fewest legs.
+    These are shortest paths when every direct trip takes the same time.
+    If to_cities is given, the search stops once all of them are reached.
+    Cities that take longer than max_time to reach are left out.
+
+    Returns dicts that associate every city reached to its travel time, its previous city and the travel time from it.
+    """
+
+    times = {from_city: 0}          # the travel time of every city reached so far
+    previous = {from_city: None}    # the city before every city reached so far
+    leg_times = {from_city: None}   # the travel time from the previous city of every city reached so far
+    frontier = [from_city]          # the cities reached with the current number of legs
+    remaining = None if to_cities is None else len(set(to_cities) - {from_city})
+
+    while frontier and remaining != 0:
+        next_frontier = []
+        for city in frontier:
+            for neighbour, leg_time in _neighbours(graph, city):
+                if neighbour not in previous and times[city] + leg_time <= max_time:
+                    times[neighbour] = times[city] + leg_time
+                    previous[neighbour] = city
+                    leg_times[neighbour] = leg_time
+                    next_frontier.append(neighbour)
+                    if remaining is not None and neighbour in to_cities:
+                        remaining -= 1
+        frontier = next_frontier
+
+    return times, previous, leg_times
+
+
+def _dijkstra(graph: networkx.Graph | GroupGraph | CSRGraph, from_city: City, to_cities: set = None,
+              max_time: float = math.inf) -> (dict, dict, dict):
+    """
+    Runs a Dijkstra search from a city over a vehicle graph, which finds the shortest paths to every city reachable.
+    If to_cities is given, the search stops once all of them are settled.
+    The search also stops once the cities left take longer than max_time to reach.
+
+    Returns dicts that associate every city settled to its travel time, its previous city and the travel time from it.
+    """
+
+    best_time = {from_city: 0}              # the best known time from from_city to every city reached so far
+    previous = {from_city: None}            # the city before every city reached so far on its best known path
+    leg_times = {from_city: None}           # the travel time from the previous city of every city reached so far
+    times = dict()                          # the (final) time of every city settled
+    tie_breaker = itertools.count()         # keeps the heap from comparing City objects when the times are equal
+    open_heap = [(0, next(tie_breaker), from_city)]
+    remaining = None if to_cities is None else len(set(to_cities))
+
+    while open_heap and remaining != 0:
+        time, _, city = heapq.heappop(open_heap)
+
+        # skips outdated entries of cities that were already reached faster
+        if city in times:
+            continue
+
+        # every city left takes longer than the time budget
+        if time > max_time:
+            break
+
+        times[city] = time
+        if remaining is not None and city in to_cities:
+            remaining -= 1
+
+        # relaxes every direct trip leaving the city
+        for neighbour, leg_time in _neighbours(graph, city, previous[city]):
+            new_time = time + leg_time
+            if neighbour not in times and new_time < best_time.get(neighbour, math.inf):
+                best_time[neighbour] = new_time
+                previous[neighbour] = city
+                leg_times[neighbour] = leg_time
+                heapq.heappush(open_heap, (new_time, next(tie_breaker), neighbour))
+
+    return times, previous, leg_times
+
+
+def _search(vehicle: Vehicle, from_city: City, to_city: City, bidirectional: bool = False,
+            stats: SearchStats = None) -> (list[City], list[float]) | None:
+    """
+    Finds a shortest path from one city to another with the fastest exact search for the routing capability of the vehicle:
+    the direct trip, a breadth first search or an A* search with a bucket queue (or a binary heap if the travel times
+    are not whole numbers of hours), unless a contraction hierarchy was built.
+    If bidirectional is True, the graph is searched from both cities at once instead.
+    If stats are given, the search used and the number of cities it settled are recorded in them.
+
+    Returns the list of cities of the path and the travel time of each of its legs, or None if there is no path.
+    """
+
+    if stats is None:
+        stats = SearchStats()
+
+    if from_city is to_city:
+        stats.method = "same city"
+        return [from_city], []
+
+    # a contraction hierarchy (or hub table) built for this vehicle answers without the graph of the vehicle (nor its components,
+    # which are found from the graph), and returns None for the cities that cannot be reached
+    hierarchy = get_contraction_hierarchy(vehicle)
+    if hierarchy is not None:
+        stats.method = "contraction hierarchy" if isinstance(hierarchy, ContractionHierarchy) else "hub table"
+        return hierarchy.shortest_path(from_city, to_city)
+
+    # cities in different components are rejected without searching
+    if not get_components(vehicle).connected(from_city, to_city):
+        stats.method = "components"
+        return None
+
+    capability = vehicle.routing_capability()
+
+    # the direct trip is a shortest path, so no graph is needed
+    if capability == RoutingCapability.direct:
+        stats.method = "direct"
+        leg_time = vehicle.compute_travel_time(from_city, to_city)
+        return None if leg_time == math.inf else ([from_city, to_city], [leg_time])
+
+    if bidirectional:
+        stats.method = "bidirectional dijkstra"
+        return _bidirectional_dijkstra(get_vehicle_graph(vehicle), from_city, to_city, stats)
+
+    if capability == RoutingCapability.unweighted:
+        stats.method = "breadth first"
+        _, previous, leg_times = _breadth_first(get_vehicle_graph(vehicle), from_city, {to_city})
+        stats.settled_forward += len(previous)
+        return _walk_back(previous, leg_times, to_city) if to_city in previous else None
+
+    # travel times are whole numbers of hours for all vehicles following the Vehicle contract, so the bucket queue is tried first
+    settled_before = stats.settled_forward
+    try:
+        stats.method = "dial"
+        return _dial(vehicle, get_vehicle_graph(vehicle), from_city, to_city, stats)
+    except _NonIntegralWeight:
+        stats.method, stats.settled_forward = "a star", settled_before
+        return _a_star(vehicle, get_vehicle_graph(vehicle), from_city, to_city, stats)
+
+
+def _as_trip(path: list[City], leg_times: list[float]) -> (Trip, list[float], float):
+    """
+    Returns the Trip of a list of cities, the travel time of each of its legs and its total travel time.
+    """
+
+    # gets the first city (departure) and creates a Trip, then adds every other city of the path
+    path_trip = Trip(path[0])
+    for city in path[1:]:
+        path_trip.add_next_city(city)
+
+    return (path_trip, leg_times, sum(leg_times))
+
+
+class ShortestPathTree():
+    """
+    The shortest paths of a vehicle from a source city to the cities it can reach.
+    """
+
+    def __init__(self, vehicle: Vehicle, source: City, times: dict, previous: dict, leg_times: dict) -> None:
+        """
+        Creates a tree from dicts that associate every city reached to its travel time from the source,
+        its previous city on the path and the travel time from it.
+        """
+        self.vehicle = vehicle          # stores the vehicle of the paths
+        self.source = source            # stores the source city
+        self.times = times              # a dict that associates every city reached to its travel time from the source
+        self.previous = previous        # a dict that associates every city reached to its previous city (None for the source)
+        self.leg_times = leg_times      # a dict that associates every city reached to the travel time from its previous city
+
+    def time_to(self, city: City) -> float:
+        """
+        Returns the travel time of a shortest path from the source to a city, or math.inf if it was not reached.
+        """
+        return self.times.get(city, math.inf)
+
+    def path_to(self, city: City) -> (Trip, list[float], float):
+        """
+        Returns a shortest path from the source to a city, the travel time of each of its legs
+        and its total travel time, or (None, [], math.inf) if it was not reached.
+        """
+        if city not in self.times:
+            return (None, [], math.inf)
+
+        return _as_trip(*_walk_back(self.previous, self.leg_times, city))
+
+
+def shortest_path_tree(vehicle: Vehicle, source: City, targets: list[City] = None) -> ShortestPathTree:
+    """
+    Returns the shortest paths of a vehicle from a source city to every city it can reach, with a single search.
+    If targets are given, the search may stop once the shortest paths to all of them are known.
+    """
+
+    capability = vehicle.routing_capability()
+
+    # the direct trips are the shortest paths
+    if capability == RoutingCapability.direct:
+        cities = list(City.cities.values()) if targets is None else list(targets)
+        direct_times = vehicle.travel_time_matrix([source], cities)[0]
+
+        times, previous, leg_times = {source: 0}, {source: None}, {source: None}
+        for city, leg_time in zip(cities, direct_times.tolist()):
+            if city is not source and leg_time != math.inf:
+                times[city], previous[city], leg_times[city] = as_hours(leg_time), source, as_hours(leg_time)
+
+        return ShortestPathTree(vehicle, source, times, previous, leg_times)
+
+    # targets in other components are never reached, so they must not keep the search going
+    if targets is not None:
+        components = get_components(vehicle)
+        targets = {target for target in targets if components.connected(source, target)}
+
+    search = _breadth_first if capability == RoutingCapability.unweighted else _dijkstra
+    times, previous, leg_times = search(get_vehicle_graph(vehicle), source, targets)
+
+    return ShortestPathTree(vehicle, source, times, previous, leg_times)
+
+
+def travel_time_matrix(vehicle: Vehicle, sources: list[City], targets: list[City]) -> np.ndarray:
+    """
+    Returns a matrix of the travel times of the shortest paths of a vehicle from every city of sources (rows)
+    to every city of targets (columns), with math.inf where there is no path.
+    Runs a single search per distinct source, which answers all targets.
+    """
+
+    matrix = np.full((len(sources), len(targets)), math.inf)
+    trees = dict()  # a dict that associates every distinct source to its shortest path tree
+
+    for source_index, source in enumerate(sources):
+        if source not in trees:
+            trees[source] = shortest_path_tree(vehicle, source, targets)
+        matrix[source_index] = [trees[source].time_to(target) for target in targets]
+
+    return matrix
+
+
+def reachable_within(vehicle: Vehicle, city: City, hours: float, as_array: bool = False) -> dict | np.ndarray:
+    """
+    Returns every city that a given vehicle can reach from a city within a number of hours (including the city itself),
+    as a dict that associates them to their shortest travel time, from the closest to the furthest.
+    The search stops expanding once the time budget is spent.
+    If as_array is True, returns an array of the travel time to every city instead, indexed by City.row,
+    with math.inf for the cities that cannot be reached in time.
+    """
+
+    capability = vehicle.routing_capability()
+
+    if capability == RoutingCapability.direct:
+        # the direct trips are the shortest paths, so the times are a single row of the travel time matrix
+        cities = list(City.cities.values())
+        direct_times = vehicle.travel_time_matrix([city], cities)[0]
+        within = [index for index in np.argsort(direct_times, kind='stable').tolist() if direct_times[index] <= hours and cities[index] is not city]
+
+        times = {city: 0}
+        for index in within:
+            times[cities[index]] = as_hours(direct_times[index])
+    else:
+        search = _breadth_first if capability == RoutingCapability.unweighted else _dijkstra
+        times = search(get_vehicle_graph(vehicle), city, max_time=hours)[0]
+
+    if not as_array:
+        return times
+
+    time_array = np.full(City.table.size, math.inf)
+    time_array[rows_of(list(times))] = list(times.values())
+    return time_array
+
+
+class RouteCache():
+    """
+    A bounded cache of the shortest paths found between two cities, keyed by the vehicle signature (str(vehicle),
+    i.e. its class name and parameters) and the IDs of the two cities.
+    When the cache is full the least recently used route is evicted, routes older than ttl seconds (if given)
+    are searched again, and all routes are dropped once cities are created.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None) -> None:
+        """
+        Creates an empty cache holding at most max_size routes, each for at most ttl seconds (forever if None).
+        """
+        self.max_size = max_size        # stores the maximum number of routes
+        self.ttl = ttl                  # stores the number of seconds a route is kept (None to keep it until evicted)
+        self.routes = OrderedDict()     # associates every key to a (time stored, cities, leg times) tuple, from the least recently used
+        self.version = City.version     # stores the City.version the routes were found for
+
+        self.hits = 0                   # number of lookups answered by the cache
+        self.misses = 0                 # number of lookups that needed a search
+        self.evictions = 0              # number of routes dropped because the cache was full or they expired
+
+    def clear(self) -> None:
+        """
+        Drops every route (the counters are kept).
+        """
+        self.routes.clear()
+        self.version = City.version
+
+    def find(self, vehicle: Vehicle, from_city: City, to_city: City, bidirectional: bool = False) -> (list[City], list[float]) | None:
+        """
+        Returns the list of cities of a shortest path between two cities for a given vehicle and the travel time
+        of each of its legs (or None if there is no path), searching it (see _search) only if it is not cached.
+        """
+
+        # the routes found for other cities may be wrong now
+        if self.version != City.version:
+            self.clear()
+
+        key = (str(vehicle), from_city.city_id, to_city.city_id)
+        cached = self.routes.get(key)
+
+        if cached is not None and self.ttl is not None and time.monotonic() - cached[0] > self.ttl:
+            del self.routes[key]
+            self.evictions += 1
+            cached = None
+
+        if cached is not None:
+            self.hits += 1
+            self.routes.move_to_end(key)
+            return None if cached[1] is None else (list(cached[1]), list(cached[2]))
+
+        self.misses += 1
+        found = _search(vehicle, from_city, to_city, bidirectional)
+
+        self.routes[key] = (time.monotonic(), None, None) if found is None else (time.monotonic(), list(found[0]), list(found[1]))
+        while len(self.routes) > self.max_size:
+            self.routes.popitem(last=False)
+            self.evictions += 1
+
+        return found
+
+    def __str__(self) -> str:
+        """
+        Returns the counters of the cache.
+        """
+        return "{} routes cached, {} hits, {} misses, {} evictions".format(len(self.routes), self.hits, self.misses, self.evictions)
+
+
+route_cache = RouteCache()  # the cache of the routes found by find_shortest_path_with_times (None to always search)
+
+
+def find_shortest_path_with_times(vehicle: Vehicle, from_city: City, to_city: City, bidirectional: bool = False,
+                                  stats: SearchStats = None) -> (Trip, list[float], float):
+    """
+    Returns a shortest path between two cities for a given vehicle, the travel time of each of its legs
+    and its total travel time, or (None, [], math.inf) if there is no path.
+    If bidirectional is True, the graph is searched from both cities until the searches meet in the middle,
+    which is faster for long paths. If stats are given, the search used and the cities it settled are recorded in them.
+    Routes are kept in route_cache, unless stats are given (as no search would be recorded).
+    """
+
+    # searches the (cached) graph of the vehicle, unless its routing capability makes it unnecessary or the route is cached
+    if route_cache is not None and stats is None:
+        found = route_cache.find(vehicle, from_city, to_city, bidirectional)
+    else:
+        found = _search(vehicle, from_city, to_city, bidirectional, stats)
+
+    # if no trip possible, returns None
+    if found is None:
+        return (None, [], math.inf)
+
+    return _as_trip(*found)
+
+
+def find_shortest_path(vehicle: Vehicle, from_city: City, to_city: City, bidirectional: bool = False) -> Trip:
+    """
+    Returns a shortest path between two cities for a given vehicle,
+    or None if there is no path.
+    """
+
+    return find_shortest_path_with_times(vehicle, from_city, to_city, bidirectional)[0]
+
+
+def k_shortest_paths(vehicle: Vehicle, from_city: City, to_city: City, k: int) -> list[(Trip, list[float], float)]:
+    """
+    Returns up to k shortest paths (without loops) between two cities for a given vehicle, from the fastest to the slowest,
+    each with the travel time of each of its legs and its total travel time.
+    Returns an empty list if there is no path.
+
+    Uses Yen's algorithm: every next path leaves one of the paths already found at some city (the spur city)
+    and takes a shortest path from there that avoids the legs the found paths take from the same start.
+    The shortest path tree to the destination is found once: it gives the first path, and the travel time from every city
+    to the destination, which is the exact heuristic of the spur searches (avoiding legs never makes a path faster),
+    so they only leave the path they look for to get around the legs they avoid. A spur search also gives up once
+    its paths take longer than enough candidates found so far.
+    """
+
+    # the graph of every vehicle has the same trips in both directions, so the tree from the destination gives the paths to it
+    tree = shortest_path_tree(vehicle, to_city)
+    if from_city not in tree.times or k <= 0:
+        return []
+    path, path_leg_times = _walk_back(tree.previous, tree.leg_times, from_city)
+    first = (path[::-1], path_leg_times[::-1])
+    if from_city is to_city:
+        return [_as_trip(*first)]
+
+    graph = get_vehicle_graph(vehicle)
+    heuristic = dict(tree.times)            # the heuristic of every city reached by any of the searches below
+    paths = [first]                         # the (cities, leg times) of the paths found, from the fastest
+    candidates = []                         # a heap of the (total travel time, tie breaker, cities, leg times) of the candidate paths
+    seen = {tuple(first[0])}                # the cities of every path found or queued as a candidate
+    tie_breaker = itertools.count()         # keeps the heap from comparing lists of City objects when the times are equal
+
+    while len(paths) < k:
+        last_path, last_leg_times = paths[-1]
+
+        for spur_index in range(len(last_path) - 1):
+            root = last_path[:spur_index + 1]
+
+            # a path slower than the candidates still needed is never returned
+            needed = k - len(paths)
+            max_time = heapq.nsmallest(needed, candidates)[-1][0] if len(candidates) >= needed else math.inf
+
+            # the spur path must leave the root with a leg that no found path with the same root takes, and must not go back through it
+            excluded_legs = {(path[spur_index], path[spur_index + 1]) for path, _ in paths if path[:spur_index + 1] == root}
+            found = _a_star(vehicle, graph, root[-1], to_city, excluded=set(root[:-1]), excluded_legs=excluded_legs, heuristic=heuristic,
+                            max_time=max_time - sum(last_leg_times[:spur_index]))
+            if found is None:
+                continue
+
+            path, path_leg_times = root[:-1] + found[0], last_leg_times[:spur_index] + found[1]
+            if tuple(path) not in seen:
+                seen.add(tuple(path))
+                heapq.heappush(candidates, (sum(path_leg_times), next(tie_breaker), path, path_leg_times))
+
+        if not candidates:
+            break
+
+        _, _, path, path_leg_times = heapq.heappop(candidates)
+        paths.append((path, path_leg_times))
+
+    return [_as_trip(path, path_leg_times) for path, path_leg_times in paths]
+
+
+def find_multimodal_path(fleet: list[Vehicle], from_city: City, to_city: City,
+                         switch_penalty: float = 0) -> (Trip, list[Vehicle], list[float], float):
+    """
+    Returns the fastest path between two cities when the vehicle may change between legs: the Trip, the vehicle
+    of every leg, the travel time of every leg and the total travel time (including switch_penalty hours
+    for every change of vehicle), or (None, [], [], math.inf) if there is no path.
+
+    Runs an A* search over (city, vehicle) states: a state is left either by a direct trip of its vehicle
+    (found in the cached graph of the vehicle, so no graph of the states is built) or by changing vehicle in the same city.
+    The direct trips that are never faster than the one taken to reach a state are skipped (see GroupGraph.neighbours),
+    e.g. a vehicle with RoutingCapability.direct only leaves the cities where the trip starts with it or changes to it,
+    and so are the states that cannot be reached before the best time found so far to the destination,
+    starting with the fastest path with a single vehicle.
+    The heuristic is the smallest lower bound of the travel time over the fleet (see Vehicle.lower_bound_travel_time),
+    which never overestimates as long as the bounds of the vehicles grow with the distance like the ones of this module.
+    """
+
+    if not fleet:
+        return (None, [], [], math.inf)
+    if from_city is to_city:
+        return (Trip(from_city), [], [], 0)
+
+    graphs = [get_vehicle_graph(vehicle) for vehicle in fleet]
+
+    # the heuristic of every city (by row of City.table), the same for all vehicles, found for all cities at once
+    # so that the direct trips to the cities that cannot lead to a faster path are left out before they are generated
+    cities = list(City.cities.values())
+    lower_bounds = np.full(City.table.size, math.inf)
+    lower_bounds[rows_of(cities)] = np.min([vehicle.lower_bound_travel_times(cities, to_city) for vehicle in fleet], axis=0)
+    lower_bounds[to_city.row] = 0
+    heuristic = lower_bounds.tolist()
+
+    # the best known time from from_city to every city (by row of City.table) with every vehicle, so that the direct trips
+    # that arrive no sooner are left out before they are generated
+    best_times = [np.full(City.table.size, math.inf) for _ in fleet]
+    previous = dict()                       # the (previous state, leg time or None for a change of vehicle) of every state reached so far
+    settled = set()                         # the states whose moves were relaxed with their best known time
+    tie_breaker = itertools.count()         # keeps the heap from comparing City objects when the times are equal
+    open_heap = []
+
+    # the fastest path with a single vehicle is the first one found, so that the search is bounded from the start
+    # and returns it if no path changing vehicle is strictly faster
+    single_paths = [find_shortest_path_with_times(vehicle, from_city, to_city) + (vehicle,) for vehicle in fleet]
+    single_trip, single_leg_times, shortest, single_vehicle = min(single_paths, key=lambda single_path: single_path[2])
+
+    # the trip can start with any vehicle
+    for vehicle_index in range(len(fleet)):
+        best_times[vehicle_index][from_city.row] = 0
+        previous[(from_city, vehicle_index)] = None
+        heapq.heappush(open_heap, (heuristic[from_city.row], 0, next(tie_breaker), from_city, vehicle_index))
+
+    while open_heap:
+        _, time_so_far, _, city, vehicle_index = heapq.heappop(open_heap)
+        state = (city, vehicle_index)
+
+        # skips outdated entries of states that were already reached faster
+        if state in settled:
+            continue
+
+        # once the destination is popped its time is optimal, so the path is rebuilt by walking back from it
+        if city is to_city:
+            path, leg_vehicles, leg_times = [city], [], []
+            while previous[state] is not None:
+                state, leg_time = previous[state]
+                if leg_time is not None:
+                    path.append(state[0])
+                    leg_vehicles.append(fleet[state[1]])
+                    leg_times.append(leg_time)
+            path.reverse()
+            leg_vehicles.reverse()
+            leg_times.reverse()
+
+            trip = _as_trip(path, leg_times)[0]
+            return (trip, leg_vehicles, leg_times, time_so_far)
+
+        settled.add(state)
+
+        # the direct trips of the current vehicle (from the city the previous trip of the vehicle left, if it was reached by one),
+        # then the changes to every other vehicle
+        previous_city = previous[state][0][0] if previous[state] is not None and previous[state][1] is not None else None
+        switched_from = fleet[previous[state][0][1]] if previous[state] is not None and previous[state][1] is None else None
+        moves = [((neighbour, vehicle_index), leg_time, leg_time)
+                 for neighbour, leg_time in _neighbours(graphs[vehicle_index], city, previous_city, shortest - time_so_far,
+                                                        lower_bounds, switched_from, best_times[vehicle_index], time_so_far)]
+        moves += [((city, other_index), switch_penalty, None) for other_index in range(len(fleet)) if other_index != vehicle_index]
+
+        # a settled state can only be reached faster if the heuristic is not consistent, and is then settled again
+        for next_state, cost, leg_time in moves:
+            new_time = time_so_far + cost
+            neighbour = next_state[0]
+            if new_time < best_times[next_state[1]][neighbour.row]:
+
+                # no path through the state can be faster than the one found to the destination
+                if neighbour is not to_city and new_time + heuristic[neighbour.row] >= shortest:
+                    continue
+                if neighbour is to_city:
+                    shortest = min(shortest, new_time)
+
+                settled.discard(next_state)
+                best_times[next_state[1]][neighbour.row] = new_time
+                previous[next_state] = (state, leg_time)
+                heapq.heappush(open_heap, (new_time + heuristic[neighbour.row], new_time, next(tie_breaker), neighbour, next_state[1]))
+
+    # no path changing vehicle is faster than the one with a single vehicle, if any
+    if single_trip is None:
+        return (None, [], [], math.inf)
+    return (single_trip, [single_vehicle] * len(single_leg_times), single_leg_times, shortest)
+
+
+def _start_fleet_worker(description: dict, worker_graph_directory: str, worker_hierarchy_directory: str) -> None:
+    """
+    Prepares a process of the pool of compare_fleet_routes: creates the cities shared by the parent process
+    (unless they were inherited by forking it) and uses the same graph and hierarchy directories.
+    """
+    global graph_directory, hierarchy_directory
+
+    graph_directory, hierarchy_directory = worker_graph_directory, worker_hierarchy_directory
+    if City.table.size == 0:
+        attach_shared_cities(description)
+
+
+def _fleet_route(vehicle: Vehicle, from_city_id: str, to_city_id: str) -> (list[str], list[float]) | None:
+    """
+    Searches a shortest path in a process of the pool of compare_fleet_routes.
+    Returns the IDs of the cities of the path (as City objects are not shared between processes)
+    and the travel time of each of its legs, or None if there is no path.
+    """
+    found = _search(vehicle, City.cities[from_city_id], City.cities[to_city_id])
+    return None if found is None else ([city.city_id for city in found[0]], found[1])
+
+
+def compare_fleet_routes(fleet: list[Vehicle], from_city: City, to_city: City, processes: int = None) -> list[(Trip, list[float], float)]:
+    """
+    Returns a shortest path between two cities for every vehicle of a fleet, in the order of the fleet,
+    like find_shortest_path_with_times: the Trip (or None if there is no path), the travel time of each of its legs
+    and its total travel time (math.inf if there is no path).
+    The vehicles are searched concurrently in a pool of processes (at most processes of them, one per vehicle by default),
+    which get the city table through shared memory.
+    """
+    if not fleet:
+        return []
+
+    blocks, description = share_cities()
+    try:
+        with ProcessPoolExecutor(max_workers=processes or min(len(fleet), os.cpu_count() or 1), initializer=_start_fleet_worker,
+                                 initargs=(description, graph_directory, hierarchy_directory)) as pool:
+            found_list = list(pool.map(_fleet_route, fleet, repeat(from_city.city_id), repeat(to_city.city_id)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    routes = []
+    for found in found_list:
+        if found is None:
+            routes.append((None, [], math.inf))
+        else:
+            routes.append(_as_trip([City.cities[city_id] for city_id in found[0]], found[1]))
+
+    return routes
+
+
 if __name__ == "__main__":
     city_country_csv_reader.create_cities_countries_from_CSV("worldcities_truncated.csv")
 
@@ -86,5 +1283,27 @@ if __name__ == "__main__":
         print("The shortest path for {} from {} to {} is {}".format(vehicle, bangalore, guiyang,
                                                                     find_shortest_path(vehicle, bangalore, guiyang)))
 
+    stats = SearchStats()
+    find_shortest_path_with_times(vehicles[1], bangalore, guiyang, bidirectional=True, stats=stats)
+    print("Bidirectional search for {} from {} to {}: {}".format(vehicles[1], bangalore, guiyang, stats))
+
+    for trip, _, total_time in k_shortest_paths(vehicles[1], bangalore, guiyang, 3):
+        print("An alternative path for {} from {} to {} is {} ({} h)".format(vehicles[1], bangalore, guiyang, trip, total_time))
+
+    reachable = reachable_within(vehicles[1], bangalore, 10)
+    print("The cities that {} can reach from {} within 10 h are {}".format(vehicles[1], bangalore, ", ".join("{} ({} h)".format(city, time) for city, time in reachable.items())))
+
+    print("Route cache: {}".format(route_cache))
+
+    for vehicle, (trip, _, total_time) in zip(vehicles, compare_fleet_routes(vehicles, melbourne, tokyo)):
+        print("The shortest path for {} from {} to {} is {} ({} h)".format(vehicle, melbourne, tokyo, trip, total_time))
+
+    trip, leg_vehicles, _, total_time = find_multimodal_path(vehicles, melbourne, tokyo, switch_penalty=1)
+    print("The fastest path from {} to {} with any vehicle of the fleet is {} ({} h, with {})".format(
+        melbourne, tokyo, trip, total_time, ", ".join(str(vehicle) for vehicle in leg_vehicles)))
+
+    trolley = TeleportingTarteTrolley(3, 2000)
+    print("The cities that {} can reach from {} are {}".format(trolley, melbourne, ", ".join(str(city) for city in reachable_cities(trolley, melbourne))))
+
     # vehicle = create_example_vehicles()[1]
     # print("The shortest path for {} from {} to {} is {}".format(vehicle, melbourne, tokyo, find_shortest_path(vehicle, melbourne, tokyo)))
\ No newline at end of file
@@ -0,0 +1,216 @@
+import heapq
+import math
+
+import numpy as np
+from geopy import distance
+
+import city_country_csv_reader
+from locations import City, Country, cached_for_cities, distances_from, rows_of
+
+LEAF_SIZE = 32  # maximum number of cities in a leaf of the tree
+
+cached_index = dict()   # a dict that associates None to a (City.version, SpatialIndex) tuple for the cities of City.cities
+
+
+def unit_vectors(cities: list[City]) -> np.ndarray:
+    """
+    Returns the 3-D unit vectors (points on the unit sphere) of a list of cities, as an array with one row per city.
+    """
+    rows = rows_of(cities)
+    latitudes = np.radians(City.table.latitudes[rows])
+    longitudes = np.radians(City.table.longitudes[rows])
+    cos_latitudes = np.cos(latitudes)
+
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+def _chord(km: float) -> float:
+    """
+    Returns the length of the straight line (through the unit sphere) between two points at a given great circle distance.
+    """
+    angle = min(km / distance.EARTH_RADIUS, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+class SpatialIndex():
+    """
+    A KD-tree over the 3-D unit vectors of a list of cities, which answers radius and nearest neighbour queries
+    without computing the distance to every city.
+    """
+
+    def __init__(self, cities: list[City]) -> None:
+        """
+        Builds the tree of the given cities.
+        """
+        self.cities = list(cities)                          # stores the cities indexed
+        self._points = unit_vectors(self.cities)            # stores the unit vector of every city, in tree order
+        self._order = np.arange(len(self.cities))           # stores the index in self.cities of every point
+
+        # stores the bounding box, the range of points and the children (-1 for leaves) of every node
+        self._lows, self._highs = [], []
+        self._starts, self._ends = [], []
+        self._lefts, self._rights = [], []
+
+        if self.cities:
+            self._build(0, len(self.cities))
+
+    def _build(self, start: int, end: int) -> int:
+        """
+        Builds the node of the points between start and end (splitting them at the median of their widest axis
+        until there are at most LEAF_SIZE of them) and returns its number.
+        """
+        node = len(self._starts)
+        points = self._points[start:end]
+
+        self._lows.append(tuple(points.min(axis=0).tolist()))
+        self._highs.append(tuple(points.max(axis=0).tolist()))
+        self._starts.append(start)
+        self._ends.append(end)
+        self._lefts.append(-1)
+        self._rights.append(-1)
+
+        if end - start > LEAF_SIZE:
+            axis = int(np.argmax(np.subtract(self._highs[node], self._lows[node])))
+            middle = (start + end) // 2
+
+            partition = np.argpartition(points[:, axis], middle - start)
+            self._points[start:end] = points[partition]
+            self._order[start:end] = self._order[start:end][partition]
+
+            self._lefts[node] = self._build(start, middle)
+            self._rights[node] = self._build(middle, end)
+
+        return node
+
+    def _gap(self, node: int, point: tuple) -> float:
+        """
+        Returns the squared distance from a point to the bounding box of a node (0 if the point is inside).
+        """
+        gap = 0.0
+        for low, high, coordinate in zip(self._lows[node], self._highs[node], point):
+            if coordinate < low:
+                gap += (low - coordinate) ** 2
+            elif coordinate > high:
+                gap += (coordinate - high) ** 2
+        return gap
+
+    def _within_chord(self, point: np.ndarray, chord: float) -> np.ndarray:
+        """
+        Returns the indices (in self.cities) of the cities whose unit vector is at most a given chord away from a point.
+        """
+        if not self.cities:
+            return np.empty(0, dtype=np.intp)
+
+        coordinates = tuple(point.tolist())
+        squared_chord = chord * chord
+        found = []
+        stack = [0]
+
+        while stack:
+            node = stack.pop()
+            if self._gap(node, coordinates) > squared_chord:
+                continue
+
+            if self._lefts[node] == -1:
+                start, end = self._starts[node], self._ends[node]
+                squared_distances = ((self._points[start:end] - point) ** 2).sum(axis=1)
+                found.append(self._order[start:end][squared_distances <= squared_chord])
+            else:
+                stack.append(self._lefts[node])
+                stack.append(self._rights[node])
+
+        return np.concatenate(found) if found else np.empty(0, dtype=np.intp)
+
+    def cities_within(self, city: City, km: float) -> list[City]:
+        """
+        Returns the cities (other than the given one) whose distance to the given city (as given by City.distance)
+        is at most km, from the closest to the furthest.
+        """
+        point = unit_vectors([city])[0]
+
+        # the chord is slightly widened so that rounding never drops a city, as the exact distances are checked below
+        candidates = [self.cities[index] for index in self._within_chord(point, _chord(km) + 1e-9) if self.cities[index] is not city]
+        distances = distances_from(city, candidates)
+
+        return [candidates[index] for index in np.argsort(distances, kind='stable') if distances[index] <= km]
+
+    def nearest(self, city: City, k: int) -> list[City]:
+        """
+        Returns the k cities (other than the given one) closest to the given city, from the closest to the furthest.
+        """
+        if not self.cities or k <= 0:
+            return []
+
+        point = unit_vectors([city])[0]
+        coordinates = tuple(point.tolist())
+
+        best = []               # a heap of the (negated squared distance, index) of the k closest cities found so far
+        nodes = [(0.0, 0)]      # a heap of the (squared gap, node) of the nodes still to visit
+
+        while nodes:
+            gap, node = heapq.heappop(nodes)
+
+            # every city left is further than the k closest found so far
+            if len(best) == k and gap > -best[0][0]:
+                break
+
+            if self._lefts[node] == -1:
+                start, end = self._starts[node], self._ends[node]
+                squared_distances = ((self._points[start:end] - point) ** 2).sum(axis=1)
+                for squared_distance, index in zip(squared_distances.tolist(), self._order[start:end].tolist()):
+                    if self.cities[index] is city:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-squared_distance, index))
+                    elif squared_distance < -best[0][0]:
+                        heapq.heapreplace(best, (-squared_distance, index))
+            else:
+                for child in (self._lefts[node], self._rights[node]):
+                    heapq.heappush(nodes, (self._gap(child, coordinates), child))
+
+        return [self.cities[index] for _, index in sorted(best, key=lambda entry: (-entry[0], entry[1]))]
+
+
+def get_spatial_index() -> SpatialIndex:
+    """
+    Returns the spatial index of all cities of City.cities.
+    The index is built once, then reused until a city is created.
+    """
+    return cached_for_cities(cached_index, None, lambda: SpatialIndex(City.cities.values()))
+
+
+def cities_within(city: City, km: float) -> list[City]:
+    """
+    Returns the cities of City.cities (other than the given one) whose distance to the given city is at most km,
+    from the closest to the furthest.
+    """
+    return get_spatial_index().cities_within(city, km)
+
+
+def nearest(city: City, k: int) -> list[City]:
+    """
+    Returns the k cities of City.cities (other than the given one) closest to the given city, from the closest to the furthest.
+    """
+    return get_spatial_index().nearest(city, k)
+
+
+def within_distances(points: np.ndarray, city: City, kms: np.ndarray) -> np.ndarray:
+    """
+    Returns the indices of the points (the unit vectors of cities, see unit_vectors) whose great circle distance
+    to the given city may be at most the distance at the same index of kms (none for a negative distance).
+    The cosine of their angle is compared with 1 - angle ** 2 / 2, which is never above the cosine of the angle of the distance
+    and avoids computing it for every point, so a few further points may be returned but none within the distance is dropped.
+    """
+    angles = kms / distance.EARTH_RADIUS
+    bounds = np.where(angles < 0, math.inf, 1 - angles * angles / 2)
+
+    return np.flatnonzero(points @ unit_vectors([city])[0] >= bounds - 1e-9)
+
+
+if __name__ == "__main__":
+    city_country_csv_reader.create_cities_countries_from_CSV("worldcities_truncated.csv")
+
+    melbourne = Country.countries["Australia"].get_city("Melbourne")
+
+    print("Cities within 1000km of {}: {}".format(melbourne, ", ".join(str(city) for city in cities_within(melbourne, 1000))))
+    print("The 5 cities closest to {}: {}".format(melbourne, ", ".join(str(city) for city in nearest(melbourne, 5))))
@@ -0,0 +1,353 @@
+import itertools
+import math
+import os
+import random
+
+import networkx
+import numpy as np
+import pytest
+
+import city_country_csv_reader
+import path_finding
+import trip_optimizer
+from csr_graph import CSRGraph
+from locations import City, CityTable, Country
+from trip import Trip
+from vehicles import CrappyCrepeCar, DiplomacyDonutDinghy, TeleportingTarteTrolley, Vehicle
+
+
+class TableVehicle(Vehicle):
+    """
+    A vehicle with the given travel times between city names, and the given lower bounds of the travel time
+    from every city name to a single destination.
+    """
+
+    def __init__(self, travel_times: dict, lower_bounds: dict) -> None:
+        self.travel_times = travel_times    # a dict that associates (name, name) pairs to travel times, both ways
+        self.lower_bounds = lower_bounds    # a dict that associates names to their lower bound
+
+    def compute_travel_time(self, departure: City, arrival: City) -> float:
+        return self.travel_times.get((departure.name, arrival.name), self.travel_times.get((arrival.name, departure.name), math.inf))
+
+    def lower_bound_travel_time(self, departure: City, arrival: City) -> float:
+        return self.lower_bounds[departure.name]
+
+    def __str__(self) -> str:
+        return "TableVehicle ({})".format(sorted(self.travel_times.items()))
+
+
+@pytest.fixture
+def no_cities(monkeypatch, tmp_path) -> None:
+    """
+    Removes every city and country, and empties the caches of path_finding.
+    """
+    monkeypatch.setattr(City, "cities", dict())
+    monkeypatch.setattr(City, "table", CityTable())
+    monkeypatch.setattr(Country, "countries", dict())
+    monkeypatch.setattr(path_finding, "route_cache", None)
+    monkeypatch.setattr(path_finding, "hierarchy_directory", str(tmp_path))
+    for cache_name in ("graph_cache", "component_cache", "hierarchy_cache"):
+        monkeypatch.setattr(path_finding, cache_name, dict())
+
+
+def _write_csv(path, rows: list[tuple]) -> None:
+    """
+    Writes a CSV file in the format of worldcities.csv with the given (name, lat, lng, country, iso3, capital, id) rows.
+    """
+    lines = ["city_ascii,lat,lng,country,iso3,capital,id"] + [",".join(str(value) for value in row) for row in rows]
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+
+def _city_data() -> list[tuple]:
+    """
+    Returns the data of every city of City.cities, in order.
+    """
+    return [(city.name, city.latitude, city.longitude, city.country, city.capital_type, city.city_id) for city in City.cities.values()]
+
+
+@pytest.fixture
+def cities(no_cities) -> list[City]:
+    """
+    Replaces the cities with 300 random ones spread over 6 countries.
+    """
+    generator = random.Random(1)
+    for country_index in range(6):
+        country_name = "Country{}".format(country_index)
+        Country(country_name, "C{:02d}".format(country_index))
+        latitude, longitude = generator.uniform(-50, 50), generator.uniform(-150, 150)
+        for city_index in range(50):
+            capital_type = "primary" if city_index == 0 else generator.choice(["admin", "minor", ""])
+            City("Town{}_{}".format(country_index, city_index), str(latitude + generator.gauss(0, 6)),
+                 str(longitude + generator.gauss(0, 8)), country_name, capital_type, str(1000 + 50 * country_index + city_index))
+
+    return list(City.cities.values())
+
+
+@pytest.mark.parametrize("vehicle", [TeleportingTarteTrolley(3, 2000), TeleportingTarteTrolley(2, 800)])
+def test_contraction_hierarchy_matches_dijkstra(cities, vehicle):
+    graph = path_finding.get_vehicle_graph(vehicle)
+    path_finding.build_contraction_hierarchy(vehicle)
+    path_finding.hierarchy_cache.clear()    # loads the hierarchy back from hierarchy_directory
+
+    generator = random.Random(2)
+    for from_city in generator.sample(cities, 20):
+        times = path_finding._dijkstra(graph, from_city)[0]
+        for to_city in generator.sample(cities, 20):
+            stats = path_finding.SearchStats()
+            trip, leg_times, total_time = path_finding.find_shortest_path_with_times(vehicle, from_city, to_city, stats=stats)
+
+            assert stats.method in ("contraction hierarchy", "same city")
+            assert total_time == times.get(to_city, math.inf)
+            if trip is not None:
+                assert trip.city_list[0] is from_city and trip.city_list[-1] is to_city
+                assert leg_times == [vehicle.compute_travel_time(city1, city2) for city1, city2 in zip(trip.city_list, trip.city_list[1:])]
+
+
+@pytest.mark.parametrize("vehicle", [DiplomacyDonutDinghy(100, 500), CrappyCrepeCar(200), TeleportingTarteTrolley(3, 1500)])
+def test_k_shortest_paths_match_networkx(cities, vehicle):
+    times = vehicle.travel_time_matrix(cities, cities)
+    graph = networkx.Graph()
+    graph.add_nodes_from(cities)
+    graph.add_weighted_edges_from((cities[row], cities[column], times[row, column])
+                                  for row, column in zip(*np.nonzero(np.isfinite(times))) if row < column)
+
+    generator = random.Random(4)
+    for _ in range(5):
+        from_city, to_city = generator.sample(cities, 2)
+        try:
+            expected = [networkx.path_weight(graph, path, "weight")
+                        for path in itertools.islice(networkx.shortest_simple_paths(graph, from_city, to_city, "weight"), 4)]
+        except networkx.NetworkXNoPath:
+            expected = []
+
+        routes = path_finding.k_shortest_paths(vehicle, from_city, to_city, 4)
+        assert [total_time for _, _, total_time in routes] == expected
+        for trip, leg_times, total_time in routes:
+            assert len(set(trip.city_list)) == len(trip.city_list) and trip.total_travel_time(vehicle) == total_time
+
+
+def test_csr_graph_reload(cities, monkeypatch, tmp_path):
+    vehicle = TeleportingTarteTrolley(3, 1500)
+    expected = path_finding._dijkstra(path_finding.build_vehicle_graph(vehicle), cities[0])[0]
+
+    monkeypatch.setattr(path_finding, "graph_directory", str(tmp_path / "graphs"))
+    saved = path_finding.get_vehicle_graph(vehicle)
+    path_finding.graph_cache.clear()
+    loaded = path_finding.get_vehicle_graph(vehicle)
+    assert isinstance(loaded, CSRGraph) and isinstance(loaded.weights, np.memmap)
+    assert path_finding._dijkstra(loaded, cities[0])[0] == expected
+
+    # saving again keeps the files the loaded graph has memory-mapped
+    weights = np.array(loaded.weights)
+    saved.save(path_finding.graph_path(vehicle, path_finding.graph_directory))
+    assert np.array_equal(loaded.weights, weights)
+
+
+def test_damaged_contraction_hierarchy_is_ignored(cities):
+    vehicle = TeleportingTarteTrolley(3, 2000)
+    path_finding.build_contraction_hierarchy(vehicle)
+    path = path_finding.hierarchy_path(vehicle, path_finding.hierarchy_directory)
+    with open(path, 'r+b') as npz_file:
+        npz_file.truncate(100)
+    path_finding.hierarchy_cache.clear()
+
+    stats = path_finding.SearchStats()
+    total_time = path_finding.find_shortest_path_with_times(vehicle, cities[0], cities[-1], stats=stats)[2]
+    assert stats.method != "contraction hierarchy"
+    assert total_time == path_finding._dijkstra(path_finding.get_vehicle_graph(vehicle), cities[0])[0].get(cities[-1], math.inf)
+
+
+def test_contraction_hierarchy_of_other_cities_is_ignored(cities):
+    vehicle = TeleportingTarteTrolley(3, 2000)
+    path_finding.build_contraction_hierarchy(vehicle)
+    City("Town0_50", "0", "0", "Country0", "", "999")
+
+    assert path_finding.get_contraction_hierarchy(vehicle) is None
+    path_finding.build_contraction_hierarchy(vehicle)
+    assert len(os.listdir(path_finding.hierarchy_directory)) == 2    # the hierarchy of the other cities is kept
+
+
+@pytest.mark.parametrize("vehicle", [DiplomacyDonutDinghy(100, 500), DiplomacyDonutDinghy(500, 100), CrappyCrepeCar(200)])
+def test_hub_table_matches_dijkstra(cities, vehicle):
+    # a second primary capital in a country, which may be reached faster through another country
+    cities.append(City("Town0_50", str(cities[0].latitude + 5), str(cities[0].longitude + 5), "Country0", "primary", "999"))
+    graph = path_finding.get_vehicle_graph(vehicle)
+    path_finding.build_contraction_hierarchy(vehicle)
+    path_finding.hierarchy_cache.clear()
+
+    generator = random.Random(3)
+    for from_city in generator.sample(cities, 10) + [cities[0], cities[-1]]:
+        times = path_finding._dijkstra(graph, from_city)[0]
+        for to_city in generator.sample(cities, 30) + [cities[0], cities[-1]]:
+            stats = path_finding.SearchStats()
+            trip, leg_times, total_time = path_finding.find_shortest_path_with_times(vehicle, from_city, to_city, stats=stats)
+
+            assert stats.method in ("hub table", "same city")
+            assert total_time == times.get(to_city, math.inf)
+            if trip is not None:
+                assert trip.city_list[0] is from_city and trip.city_list[-1] is to_city
+                assert leg_times == [vehicle.compute_travel_time(city1, city2) for city1, city2 in zip(trip.city_list, trip.city_list[1:])]
+
+
+@pytest.mark.parametrize("travel_times, expected", [
+    ({("S", "A"): 1, ("A", "B"): 1, ("S", "B"): 5, ("B", "T"): 1}, 3),
+    ({("S", "A"): 1, ("A", "B"): 1, ("S", "B"): 5, ("B", "T"): 1, ("S", "T"): 10}, 3),
+])
+def test_inconsistent_lower_bounds(no_cities, travel_times, expected):
+    # the bounds never overestimate, but the one of A is larger than the trip to B plus the one of B
+    Country("Country", "CCC")
+    cities = {name: City(name, str(index), str(index), "Country", "", str(index)) for index, name in enumerate("SABT")}
+    vehicle = TableVehicle(travel_times, {"S": 0, "A": 2, "B": 0, "T": 0})
+
+    for search in (path_finding._dial, path_finding._a_star):
+        path, leg_times = search(vehicle, path_finding.get_vehicle_graph(vehicle), cities["S"], cities["T"])
+        assert [city.name for city in path] == ["S", "A", "B", "T"]
+        assert sum(leg_times) == expected
+
+    assert path_finding.find_shortest_path_with_times(vehicle, cities["S"], cities["T"])[2] == expected
+
+
+@pytest.mark.parametrize("vehicle", [DiplomacyDonutDinghy(100, 500), TeleportingTarteTrolley(3, 1500), CrappyCrepeCar(200)])
+def test_dial_matches_dijkstra(cities, vehicle):
+    graph = path_finding.get_vehicle_graph(vehicle)
+    generator = random.Random(6)
+    for from_city in generator.sample(cities, 10):
+        times = path_finding._dijkstra(graph, from_city)[0]
+        for to_city in generator.sample(cities, 10):
+            found = path_finding._dial(vehicle, graph, from_city, to_city)
+            assert (sum(found[1]) if found is not None else math.inf) == times.get(to_city, math.inf)
+            if found is not None:
+                assert found[0][0] is from_city and found[0][-1] is to_city
+
+
+@pytest.mark.parametrize("vehicle", [DiplomacyDonutDinghy(100, 500), TeleportingTarteTrolley(3, 1500), CrappyCrepeCar(200)])
+def test_bidirectional_dijkstra_matches_dijkstra(cities, vehicle):
+    graph = path_finding.get_vehicle_graph(vehicle)
+    generator = random.Random(7)
+    for from_city in generator.sample(cities, 10):
+        times = path_finding._dijkstra(graph, from_city)[0]
+        for to_city in generator.sample([city for city in cities if city is not from_city], 10):
+            found = path_finding._bidirectional_dijkstra(graph, from_city, to_city)
+            assert (sum(found[1]) if found is not None else math.inf) == times.get(to_city, math.inf)
+            if found is not None:
+                path, leg_times = found
+                assert path[0] is from_city and path[-1] is to_city
+                assert leg_times == [vehicle.compute_travel_time(city1, city2) for city1, city2 in zip(path, path[1:])]
+
+
+def test_dial_with_long_travel_times(no_cities):
+    # the estimates between the buckets are never visited one by one, which would take about 10 ** 12 steps
+    Country("Country", "CCC")
+    cities = [City("City{}".format(index), str(index), str(index), "Country", "", str(index)) for index in range(20)]
+    travel_times = {(city1.name, city2.name): 10 ** 12 for city1, city2 in zip(cities, cities[1:])}
+    vehicle = TableVehicle(travel_times, {city.name: 0 for city in cities})
+
+    path, leg_times = path_finding._dial(vehicle, path_finding.get_vehicle_graph(vehicle), cities[0], cities[-1])
+    assert path == cities and sum(leg_times) == 19 * 10 ** 12
+
+
+def test_snapshot_round_trip(no_cities, monkeypatch, tmp_path):
+    path = tmp_path / "cities.csv"
+    _write_csv(path, [("Melbourne", -37.8136, 144.9631, "Australia", "AUS", "admin", 1036533631),
+                      ("Canberra", -35.2931, 149.1269, "Australia", "AUS", "primary", 1036142029),
+                      ("Tokyo", 35.6897, 139.6922, "Japan", "JPN", "primary", 1392685764)])
+    city_country_csv_reader.create_cities_countries_from_CSV(str(path))
+    expected = _city_data()
+
+    monkeypatch.setattr(City, "cities", dict())
+    monkeypatch.setattr(City, "table", CityTable())
+    monkeypatch.setattr(Country, "countries", dict())
+    assert city_country_csv_reader.load_snapshot(str(path))
+    assert _city_data() == expected
+
+    # a new snapshot replaces the files instead of writing over the ones memory-mapped above
+    mapped = np.load(tmp_path / "cities.csv.snapshot" / "latitudes.npy", mmap_mode='r')
+    _write_csv(path, [("Sydney", -33.865, 151.2094, "Australia", "AUS", "admin", 1036074917)])
+    monkeypatch.setattr(City, "cities", dict())
+    monkeypatch.setattr(City, "table", CityTable())
+    monkeypatch.setattr(Country, "countries", dict())
+    city_country_csv_reader.create_cities_countries_from_CSV(str(path))
+
+    assert np.array_equal(mapped, [latitude for _, latitude, _, _, _, _ in expected])
+    assert [name for name, *_ in _city_data()] == ["Sydney"]
+
+
+def test_find_fastest_vehicle_keeps_the_leg_times(cities, monkeypatch):
+    vehicle = CrappyCrepeCar(200)
+    calls = []
+    compute_travel_time = vehicle.compute_travel_time
+    monkeypatch.setattr(vehicle, "compute_travel_time", lambda departure, arrival: calls.append(1) or compute_travel_time(departure, arrival))
+
+    trip = Trip(cities[0])
+    for city in cities[1:12]:
+        trip.add_next_city(city)
+
+    for _ in range(3):
+        assert trip.find_fastest_vehicle([vehicle]) == (vehicle, trip.total_travel_time(vehicle))
+    assert len(calls) == 11
+
+    trip.add_next_city(cities[12])
+    assert trip.find_fastest_vehicle([vehicle])[1] == sum(trip.leg_times(vehicle).as_list())
+    assert len(calls) == 23
+
+
+@pytest.mark.parametrize("fixed", ["none", "start", "end", "both", "round trip"])
+def test_optimize_trip_matches_exhaustive_search(cities, fixed):
+    generator = random.Random(5)
+    for vehicle in (CrappyCrepeCar(200), DiplomacyDonutDinghy(100, 500), TeleportingTarteTrolley(3, 3000)):
+        for _ in range(10):
+            stops = generator.sample(cities, generator.randint(2, 6))
+            start = stops[0] if fixed in ("start", "both", "round trip") else None
+            end = {"end": stops[-1], "both": stops[-1], "round trip": stops[0]}.get(fixed)
+            round_trip = fixed == "round trip"
+
+            trip, total_time = trip_optimizer.optimize_trip(vehicle, stops, start, end, time_budget=5)
+            assert sorted(trip.city_list[:-1] if round_trip else trip.city_list, key=id) == sorted(stops, key=id)
+            assert start is None or trip.city_list[0] is start
+            assert end is None or trip.city_list[-1] is end
+
+            best_time = math.inf
+            for order in itertools.permutations(stops):
+                if (start is not None and order[0] is not start) or (end is not None and not round_trip and order[-1] is not end):
+                    continue
+                best_trip = Trip(order[0])
+                for city in order[1:] + ((order[0],) if round_trip else ()):
+                    best_trip.add_next_city(city)
+                best_time = min(best_time, best_trip.total_travel_time(vehicle))
+            assert total_time == best_time
+
+
+@pytest.mark.parametrize("large_group_size", [path_finding.LARGE_GROUP_SIZE, 20])
+@pytest.mark.parametrize("switch_penalty", [0, 3])
+def test_find_multimodal_path_matches_product_graph(cities, monkeypatch, large_group_size, switch_penalty):
+    monkeypatch.setattr(path_finding, "LARGE_GROUP_SIZE", large_group_size)    # also narrows the groups of the cities down by distance
+    for fleet in ([CrappyCrepeCar(50), DiplomacyDonutDinghy(100, 500)], [CrappyCrepeCar(200), DiplomacyDonutDinghy(100, 500)],
+                  [CrappyCrepeCar(150), DiplomacyDonutDinghy(100, 500), TeleportingTarteTrolley(1, 800)]):
+
+        # a graph of the (city index, vehicle index) states, with an edge for every direct trip and every change of vehicle
+        graph = networkx.DiGraph()
+        for vehicle_index, vehicle in enumerate(fleet):
+            times = vehicle.travel_time_matrix(cities, cities)
+            graph.add_weighted_edges_from(((row, vehicle_index), (column, vehicle_index), times[row, column])
+                                          for row, column in zip(*np.nonzero(np.isfinite(times))) if row != column)
+            graph.add_weighted_edges_from(((row, vehicle_index), (row, other_index), switch_penalty)
+                                          for row in range(len(cities)) for other_index in range(len(fleet)) if other_index != vehicle_index)
+
+        generator = random.Random(6)
+        for _ in range(8):
+            from_index, to_index = generator.sample(range(len(cities)), 2)
+            graph.add_weighted_edges_from([("from", (from_index, vehicle_index), 0) for vehicle_index in range(len(fleet))] +
+                                          [((to_index, vehicle_index), "to", 0) for vehicle_index in range(len(fleet))])
+            try:
+                expected = networkx.shortest_path_length(graph, "from", "to", "weight")
+            except networkx.NetworkXNoPath:
+                expected = math.inf
+            graph.remove_nodes_from(("from", "to"))
+
+            trip, leg_vehicles, leg_times, total_time = path_finding.find_multimodal_path(fleet, cities[from_index], cities[to_index], switch_penalty)
+            assert total_time == expected
+            if trip is not None:
+                changes = sum(1 for vehicle1, vehicle2 in zip(leg_vehicles, leg_vehicles[1:]) if vehicle1 is not vehicle2)
+                assert leg_times == [vehicle.compute_travel_time(city1, city2)
+                                     for vehicle, city1, city2 in zip(leg_vehicles, trip.city_list, trip.city_list[1:])]
+                assert sum(leg_times) + switch_penalty * changes == total_time
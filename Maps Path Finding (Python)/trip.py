@@ -1,11 +1,45 @@
 import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
 
 from vehicles import Vehicle, CrappyCrepeCar, DiplomacyDonutDinghy, TeleportingTarteTrolley
-from vehicles import create_example_vehicles
-from locations import City, Country
+from vehicles import as_hours, create_example_vehicles
+from locations import City, Country, attach_shared_cities, share_cities
 from locations import create_example_countries_and_cities
 
 
+class LegTimes():
+    """
+    The travel times of the legs of a trip for a vehicle, in hours (math.inf for the legs that are not possible).
+    """
+
+    __slots__ = ("hours",)
+
+    def __init__(self, hours: np.ndarray) -> None:
+        """
+        Creates the result from an array of the travel time of every leg.
+        """
+        self.hours = hours  # stores the travel time of every leg, as a float64 array
+
+    @property
+    def total(self) -> float:
+        """
+        Returns the travel duration of the entire trip, or math.inf if any leg is not possible.
+        """
+        return sum(self.as_list())
+
+    def as_list(self) -> list[float]:
+        """
+        Returns the travel time of every leg as compute_travel_time returns it (an int for whole hours).
+        """
+        return [as_hours(leg_time) for leg_time in self.hours.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.hours)
+
+
 class Trip():
     """
     Represents a sequence of cities.
@@ -16,7 +50,7 @@ class Trip():
         Initialises a Trip with a departure city.
         """
         self.city_list = []                 # stores the cities involved in the trip
-        self.every_time_list = []           # stores the time taken between cities (list in a list) for each vehicle passed (required for Task 7)
+        self._leg_times = dict()            # a dict that associates a vehicle signature (str(vehicle)) to the LegTimes of the trip
 
         self.dept_city = departure          # stores departure city
         self.city_list.append(departure)    # stores departure city in city list
@@ -26,61 +60,89 @@ class Trip():
         Adds the next city to this trip.
         """
         self.city_list.append(city)         # stores other cities of the trip in self.city_list
+        self._leg_times.clear()             # the legs computed so far no longer cover the whole trip
+
+    def leg_times(self, vehicle: Vehicle) -> LegTimes:
+        """
+        Returns the travel time of every leg of the trip for a given vehicle.
+        The result is computed once per vehicle signature (str(vehicle)), until a city is added to the trip.
+        """
+
+        key = str(vehicle)  # the vehicle signature, i.e. its class name and parameters
+
+        if key not in self._leg_times:
+            # calls compute_travel_time method of the specific vehicle for every pair of consecutive cities
+            hours = [vehicle.compute_travel_time(self.city_list[i], self.city_list[i+1]) for i in range(len(self.city_list)-1)]
+            self._leg_times[key] = LegTimes(np.array(hours, dtype=np.float64))
+
+        return self._leg_times[key]
 
     def total_travel_time(self, vehicle: Vehicle) -> float:
         """
         Returns a travel duration for the entire trip for a given vehicle.
         Returns math.inf if any leg (i.e. part) of the trip is not possible.
         """
+        return self.leg_times(vehicle).total
 
-        time_list = []  # stores the time for vehicle to move between 2 cities
-
-        for i in range(len(self.city_list)-1):
+    def _travel_time_within(self, vehicle: Vehicle, limit: float, strict: bool) -> float | None:
+        """
+        Returns the travel duration of the entire trip for a given vehicle, or None as soon as the sum of the legs
+        computed so far is over limit (or not under it if strict), or a leg is not possible.
+        """
 
-            # gets departure and arrival cities
-            departure = self.city_list[i]
-            arrival = self.city_list[i+1]
+        # the legs already computed for this vehicle give the total directly
+        known = self._leg_times.get(str(vehicle))
+        if known is not None:
+            total_time = known.total
+            return None if total_time == math.inf or total_time > limit or (strict and total_time >= limit) else total_time
 
-            # calls compute_travel_time method of the specific vehicle to get the time and stores in time_list
-            time = vehicle.compute_travel_time(departure, arrival)
-            time_list.append(time)
+        total_time = 0  # stores the sum of the legs computed so far
+        hours = []      # stores the legs computed so far
 
-            # if time is math.inf, return math.inf
-            if time == math.inf:
-                self.every_time_list.append(time_list)
-                return math.inf
+        for i in range(len(self.city_list)-1):
+            hours.append(vehicle.compute_travel_time(self.city_list[i], self.city_list[i+1]))
+            total_time += hours[-1]
 
-        # stores time_list in self.time_list
-        self.every_time_list.append(time_list)
+            # travel times are never negative, so the remaining legs cannot bring the total back under the limit
+            if total_time == math.inf or total_time > limit or (strict and total_time >= limit):
+                return None
 
-        return sum(time_list)   # retruns total time taken
+        # every leg was computed, so they are kept like leg_times does
+        self._leg_times[str(vehicle)] = LegTimes(np.array(hours, dtype=np.float64))
+        return total_time
 
     def find_fastest_vehicle(self, vehicles: list[Vehicle]) -> (Vehicle, float):
         """
         Returns the Vehicle for which this trip is fastest, and the duration of the trip.
         If there is a tie, return the first vehicle in the list.
         If the trip is not possible for any of the vehicle, return (None, math.inf).
+
+        The vehicles are tried from the smallest lower bound of the travel time from the first city to the last one
+        (see Vehicle.lower_bound_travel_time), and a vehicle is abandoned as soon as its legs add up to more
+        than the fastest duration found so far, so that most legs of slow vehicles are never computed.
         """
-        time_val = dict()   # stores the vehicle as the key and minimum time as the value
 
-        # for every vehicle compute the total travel time and stores in the dictionary to the corresponding key
-        for vehc in vehicles:
-            time_val.update({vehc: self.total_travel_time(vehc)})
+        departure, arrival = self.city_list[0], self.city_list[-1]
+        lower_bounds = [vehc.lower_bound_travel_time(departure, arrival) for vehc in vehicles]
 
-        # calculate the number of math.inf in teh values list that stores the time for each vehicle
-        num_of_inf = list(time_val.values()).count(math.inf)
+        best_index, best_time = None, math.inf  # stores the index of the fastest vehicle found so far and its duration
 
-        # if all vehicles have time math.inf, return (None, math.inf)
-        if num_of_inf == len(vehicles):
-            return (None, math.inf)
+        for index in sorted(range(len(vehicles)), key=lambda index: (lower_bounds[index], index)):
 
-        # else, find the minimum time from the list and returns the corresponding vehicle adn time for the one with the smallest time
-        else:
-            min_time = min(list(time_val.values()))
+            # a vehicle can only replace the fastest one found so far by being faster, or as fast and before it in the list
+            strict = best_index is not None and index > best_index
+            if lower_bounds[index] > best_time or (strict and lower_bounds[index] >= best_time):
+                continue
 
-            for key, value in time_val.items():
-                if value == min_time:
-                    return (key, value)
+            time = self._travel_time_within(vehicles[index], best_time, strict)
+            if time is not None:
+                best_index, best_time = index, time
+
+        # if no vehicle can do the trip, return (None, math.inf)
+        if best_index is None:
+            return (None, math.inf)
+
+        return (vehicles[best_index], best_time)
 
     def __str__(self) -> str:
         """
@@ -125,6 +187,80 @@ def create_example_trips() -> list[Trip]:
     return trips
 
 
+def _score_city_lists(city_lists: list[list[City]], vehicles: list[Vehicle]) -> np.ndarray:
+    """
+    Returns a matrix of the travel durations of trips given as lists of cities (rows) for every vehicle (columns).
+    """
+    leg_of = dict()                 # a dict that associates every distinct (departure, arrival) pair to its index
+    departures, arrivals = [], []   # stores the departure and arrival city of every distinct leg
+    leg_indexes, trip_indexes = [], []  # stores the index of the distinct leg and of the trip of every leg of every trip
+
+    for trip_index, cities in enumerate(city_lists):
+        for departure, arrival in zip(cities, cities[1:]):
+            leg_index = leg_of.get((departure, arrival))
+            if leg_index is None:
+                leg_index = leg_of[(departure, arrival)] = len(departures)
+                departures.append(departure)
+                arrivals.append(arrival)
+            leg_indexes.append(leg_index)
+            trip_indexes.append(trip_index)
+
+    leg_indexes = np.array(leg_indexes, dtype=np.intp)
+    trip_indexes = np.array(trip_indexes, dtype=np.intp)
+    scores = np.zeros((len(city_lists), len(vehicles)))
+
+    # computes every distinct leg once per vehicle, then adds the legs of every trip up
+    for vehicle_index, vehicle in enumerate(vehicles):
+        leg_times = vehicle.leg_travel_times(departures, arrivals)
+        scores[:, vehicle_index] = np.bincount(trip_indexes, weights=leg_times[leg_indexes], minlength=len(city_lists))
+
+    return scores
+
+
+def _start_scoring_worker(description: dict) -> None:
+    """
+    Prepares a process of the pool of score_trips: creates the cities shared by the parent process
+    (unless they were inherited by forking it).
+    """
+    if City.table.size == 0:
+        attach_shared_cities(description)
+
+
+def _score_chunk(trip_city_ids: list[list[str]], vehicles: list[Vehicle]) -> np.ndarray:
+    """
+    Scores a chunk of trips (given by the IDs of their cities, as City objects are not shared between processes)
+    in a process of the pool of score_trips.
+    """
+    return _score_city_lists([[City.cities[city_id] for city_id in city_ids] for city_ids in trip_city_ids], vehicles)
+
+
+def score_trips(trips: list[Trip], vehicles: list[Vehicle], processes: int = None, chunk_size: int = 10000) -> np.ndarray:
+    """
+    Returns a matrix of the travel durations of every trip (rows) for every vehicle (columns), as total_travel_time
+    would return them (math.inf where a trip is not possible for a vehicle).
+    Every distinct leg of the trips is computed only once per vehicle, with array arithmetic (see Vehicle.leg_travel_times).
+    If processes is given, the trips are scored in chunks of chunk_size trips by a pool of that many processes,
+    which get the city table through shared memory.
+    """
+
+    if not processes or len(trips) <= chunk_size:
+        return _score_city_lists([trip.city_list for trip in trips], vehicles)
+
+    chunks = [[[city.city_id for city in trip.city_list] for trip in trips[start:start + chunk_size]]
+              for start in range(0, len(trips), chunk_size)]
+
+    blocks, description = share_cities()
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_start_scoring_worker, initargs=(description,)) as pool:
+            scores = list(pool.map(_score_chunk, chunks, repeat(vehicles)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return np.vstack(scores)
+
+
 if __name__ == "__main__":
     vehicles = create_example_vehicles()
     trips = create_example_trips()
@@ -137,3 +273,6 @@ if __name__ == "__main__":
     for trip in trips:
         vehicle, duration = trip.find_fastest_vehicle(vehicles)
         print("The trip {} will take {} hours with {}".format(trip, duration, vehicle))
+
+    print("")
+    print(score_trips(trips, vehicles))
@@ -0,0 +1,193 @@
+import math
+import time
+
+import numpy as np
+
+from locations import City, Country, create_example_countries_and_cities
+from trip import Trip
+from vehicles import Vehicle, create_example_vehicles
+
+IMPROVEMENT = 1e-9  # smallest decrease of the cost of an order for a move to be applied
+
+matrix_cache = dict()   # a dict that associates a vehicle signature (str(vehicle)) to its last (City.version, city IDs, travel time matrix) tuple
+
+
+def _stop_matrix(vehicle: Vehicle, stops: list[City]) -> np.ndarray:
+    """
+    Returns the matrix of the travel times of the direct trips of a vehicle between every two stops.
+    The last matrix of every vehicle is kept, so that optimizing the same stops again does not compute it again.
+    """
+    key = str(vehicle)  # the vehicle signature, i.e. its class name and parameters
+    city_ids = tuple(stop.city_id for stop in stops)
+    cached = matrix_cache.get(key)
+
+    if cached is None or cached[0] != City.version or cached[1] != city_ids:
+        cached = (City.version, city_ids, vehicle.travel_time_matrix(stops, stops))
+        matrix_cache[key] = cached
+
+    return cached[2]
+
+
+def _order_cost(costs: np.ndarray, order: np.ndarray) -> float:
+    """
+    Returns the cost of visiting the stops in the given order (of a padded order, the padding costs nothing).
+    """
+    return float(costs[order[:-1], order[1:]].sum())
+
+
+def _nearest_neighbour(costs: np.ndarray, first: int, last: int | None) -> list[int]:
+    """
+    Returns an order of the stops that goes from the first one to the closest stop not visited yet, until all are visited.
+    If last is given, it is kept for the end (it is the first one for a round trip).
+    """
+    visited = np.zeros(len(costs), dtype=bool)
+    visited[first] = True
+    if last is not None:
+        visited[last] = True
+
+    order = [first]
+    for _ in range(len(costs) - visited.sum()):
+        row = np.where(visited, math.inf, costs[order[-1]])
+        order.append(int(np.argmin(row)))
+        visited[order[-1]] = True
+
+    if last is not None:
+        order.append(last)
+    return order
+
+
+def _two_opt(costs: np.ndarray, order: np.ndarray, low: int, high: int, deadline: float) -> bool:
+    """
+    Reverses the parts order[i:j + 1] (low <= i < j <= high) of a padded order that make it cheaper, in place.
+    Only valid for symmetric costs. Returns whether the order changed.
+    """
+    changed = False
+
+    for i in range(low, high):
+        if time.monotonic() > deadline:
+            break
+
+        before, first = order[i - 1], order[i]
+        ends = order[i + 1:high + 1]          # the candidate last stops of the reversed part
+        afters = order[i + 2:high + 2]        # the stops following them
+        deltas = costs[before, ends] + costs[first, afters] - costs[before, first] - costs[ends, afters]
+
+        best = int(np.argmin(deltas)) if len(deltas) else 0
+        if len(deltas) and deltas[best] < -IMPROVEMENT:
+            j = i + 1 + best
+            order[i:j + 1] = order[i:j + 1][::-1].copy()
+            changed = True
+
+    return changed
+
+
+def _or_opt(costs: np.ndarray, order: np.ndarray, low: int, high: int, deadline: float) -> bool:
+    """
+    Moves the parts of 1 to 3 consecutive stops of a padded order (between positions low and high) to the place
+    where they make it cheapest, in place. Returns whether the order changed.
+    """
+    changed = False
+
+    for length in (1, 2, 3):
+        i = low
+        while i + length - 1 <= high:
+            if time.monotonic() > deadline:
+                return changed
+
+            first, last = order[i], order[i + length - 1]
+            before, after = order[i - 1], order[i + length]
+            removal_gain = costs[before, first] + costs[last, after] - costs[before, after]
+
+            # the edges (order[k], order[k + 1]) the part can be inserted in, away from the part itself
+            rest = np.concatenate((order[:i], order[i + length:]))
+            edges = np.arange(low - 1, high - length + 1)
+            insertion_costs = costs[rest[edges], first] + costs[last, rest[edges + 1]] - costs[rest[edges], rest[edges + 1]]
+            insertion_costs[edges == i - 1] = math.inf  # putting the part back where it was
+
+            best = int(np.argmin(insertion_costs)) if len(edges) else 0
+            if len(edges) and insertion_costs[best] - removal_gain < -IMPROVEMENT:
+                k = int(edges[best])
+                part = order[i:i + length].copy()
+                order[:] = np.concatenate((rest[:k + 1], part, rest[k + 1:]))
+                changed = True
+            else:
+                i += 1
+
+    return changed
+
+
+def optimize_trip(vehicle: Vehicle, stops: list[City], start: City = None, end: City = None,
+                  time_budget: float = 0.5) -> (Trip, float):
+    """
+    Returns a Trip visiting all stops in a near-minimal order for a given vehicle, and its total travel time
+    (math.inf if every order has a leg that is not possible).
+    If start (or end) is given, the trip starts (or ends) there, and it is added to the stops if needed.
+    If start and end are the same city, the trip is a round trip that comes back to it, and the last leg is counted.
+
+    The order is built by always going to the closest stop not visited yet (or kept as given if that is faster),
+    then improved by reversing parts of it (2-opt) and moving short parts elsewhere (Or-opt)
+    until no move helps or time_budget seconds have passed.
+    """
+    stops = list(stops)
+    if start is not None and start not in stops:
+        stops.insert(0, start)
+    if end is not None and end not in stops:
+        stops.append(end)
+    if not stops:
+        return (None, math.inf)
+
+    n = len(stops)
+    deadline = time.monotonic() + time_budget
+    times = _stop_matrix(vehicle, stops)
+
+    # legs that are not possible cost more than any order of possible ones, so that as few of them as possible are kept
+    finite = times[np.isfinite(times)]
+    impossible = (float(finite.max()) if len(finite) else 1.0) * n + 1.0
+
+    # the order is padded with a stop (index n) at both ends that costs nothing to reach or leave, so that
+    # the first and last stops can be moved like the others when they are not fixed
+    costs = np.zeros((n + 1, n + 1))
+    costs[:n, :n] = np.where(np.isfinite(times), times, impossible)
+
+    # a round trip ends with its first stop again, unless there is no other stop to come back from
+    round_trip = start is not None and end is start and n > 1
+    first = stops.index(start) if start is not None else (1 if n > 1 and stops[0] is end else 0)
+    last = stops.index(end) if end is not None and (round_trip or end is not stops[first]) else None
+
+    given = [index for index in range(n) if index != first and index != last]
+    given = [first] + given + ([last] if last is not None else [])
+    candidates = [np.array([n] + given + [n]), np.array([n] + _nearest_neighbour(costs[:n, :n], first, last) + [n])]
+    order = min(candidates, key=lambda candidate: _order_cost(costs, candidate))
+
+    # the positions of the stops that may move (the padding is at 0 and len(given) + 1)
+    low = 2 if start is not None else 1
+    high = len(given) - 1 if last is not None else len(given)
+    symmetric = np.array_equal(costs, costs.T)
+
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = _or_opt(costs, order, low, high, deadline)
+        if symmetric:
+            improved = _two_opt(costs, order, low, high, deadline) or improved
+
+    # creates the trip in the order found
+    trip = Trip(stops[order[1]])
+    for index in order[2:-1]:
+        trip.add_next_city(stops[index])
+
+    return (trip, trip.total_travel_time(vehicle))
+
+
+if __name__ == "__main__":
+    create_example_countries_and_cities()
+
+    australia = Country.countries["Australia"]
+    melbourne = australia.get_city("Melbourne")
+    sydney = australia.get_city("Sydney")
+    canberra = australia.get_city("Canberra")
+    japan = Country.countries["Japan"]
+    tokyo = japan.get_city("Tokyo")
+
+    for vehicle in create_example_vehicles():
+        trip, duration = optimize_trip(vehicle, [melbourne, tokyo, sydney, canberra], start=melbourne)
+        print("The best order for {} is {} ({} hours)".format(vehicle, trip, duration))
@@ -1,9 +1,26 @@
 import math
 from abc import ABC, abstractmethod
+from enum import Enum
 
-from locations import CapitalType, City, Country
+import numpy as np
+
+from locations import CAPITAL_TYPES, CapitalType, City, Country, distance_matrix, pair_distances, rows_of
 from locations import create_example_countries_and_cities
 
+PRIMARY_CODE = CAPITAL_TYPES.index(CapitalType.primary)    # the capital code of primary capitals in City.table
+
+class RoutingCapability(Enum):
+    """
+    The structure of the travel times of a vehicle that path_finding can use to pick its search (e.g. "unweighted").
+    """
+    direct = "direct"           # can go from any city to any other, and a direct trip is never slower than several legs
+    unweighted = "unweighted"   # every direct trip takes the same time, so a path with the fewest legs is a shortest path
+    weighted = "weighted"       # no particular structure
+
+    def __str__(self) -> str:
+        return self.value
+
+
 class Vehicle(ABC):
     """
     A Vehicle defined by a mode of transportation, which results in a specific duration.
@@ -18,6 +35,85 @@ class Vehicle(ABC):
         """
         pass
 
+    def travel_time_matrix(self, origins: list[City], destinations: list[City]) -> np.ndarray:
+        """
+        Returns a matrix of the travel durations of the direct trips from every city of origins (rows)
+        to every city of destinations (columns), in hours, with math.inf where the travel is not possible.
+        By default calls compute_travel_time for every pair, so subclasses should override it with array arithmetic.
+        """
+        return np.array([[self.compute_travel_time(departure, arrival) for arrival in destinations] for departure in origins],
+                        dtype=np.float64).reshape(len(origins), len(destinations))
+
+    def leg_travel_times(self, departures: list[City], arrivals: list[City]) -> np.ndarray:
+        """
+        Returns an array of the travel durations of the direct trips from every city of departures to the city
+        at the same position in arrivals, in hours, with math.inf where the travel is not possible.
+        By default calls compute_travel_time for every pair, so subclasses should override it with array arithmetic.
+        """
+        return np.array([self.compute_travel_time(departure, arrival) for departure, arrival in zip(departures, arrivals)],
+                        dtype=np.float64)
+
+    def routing_capability(self) -> RoutingCapability:
+        """
+        Returns the structure of the travel times of the vehicle, which path_finding uses to pick the fastest exact search.
+        By default returns RoutingCapability.weighted, which is always valid.
+        """
+        return RoutingCapability.weighted
+
+    def lower_bound_travel_time(self, departure: City, arrival: City) -> float:
+        """
+        Returns a lower bound of the travel duration from one city to another, in hours,
+        over any sequence of direct trips (e.g. the great circle distance divided by the best speed).
+        It must never overestimate, as it is used as the heuristic of the A* search in path_finding.
+        It should also be consistent, i.e. never exceed the travel time of a direct trip plus the bound from the city
+        it arrives at (like a distance divided by a speed): the A* search then settles every city once,
+        while an inconsistent bound makes it settle some cities again to stay exact.
+        By default returns 0, which is always valid.
+        """
+        return 0
+
+    def lower_bound_travel_times(self, departures: list[City], arrival: City) -> np.ndarray:
+        """
+        Returns an array of the lower bounds of the travel durations from every city of departures to a city
+        (see lower_bound_travel_time).
+        By default calls lower_bound_travel_time for every city, so subclasses should override it with array arithmetic.
+        """
+        return np.array([self.lower_bound_travel_time(departure, arrival) for departure in departures], dtype=np.float64)
+
+    def max_leg_distance(self, max_leg_time: float = math.inf) -> float:
+        """
+        Returns a distance in km such that no direct trip (taking at most max_leg_time hours, if given) is possible
+        between two cities further apart than it, which lets path_finding only consider nearby cities when building
+        the graph of the vehicle or looking for the trips that fit in the time left.
+        By default returns math.inf, i.e. any two cities may be connected.
+        """
+        return math.inf
+
+    def max_leg_distances(self, max_leg_times: np.ndarray) -> np.ndarray:
+        """
+        Returns an array of the distances given by max_leg_distance for every time of max_leg_times.
+        By default calls max_leg_distance for every time, so subclasses should override it with array arithmetic.
+        """
+        return np.array([self.max_leg_distance(max_leg_time) for max_leg_time in max_leg_times.tolist()], dtype=np.float64)
+
+    def leg_groups(self, cities: list[City]) -> list[list[City]] | None:
+        """
+        Returns groups of the given cities such that a direct trip is possible between two cities
+        if and only if they belong to a same group, which lets path_finding generate the neighbours of a city
+        on demand rather than storing every edge.
+        By default returns None, i.e. the connections have no such structure.
+        """
+        return None
+
+    def leg_group_is_direct(self, group: list[City]) -> bool:
+        """
+        Returns whether a direct trip between two cities of a group returned by leg_groups is never slower
+        than going through other cities of the same group, which lets path_finding skip the trips within the group
+        from a city that was reached by a trip within it.
+        By default returns False, which is always valid.
+        """
+        return False
+
     @abstractmethod
     def __str__(self) -> str:
         """
@@ -26,6 +122,16 @@ class Vehicle(ABC):
         pass
 
 
+def as_hours(time: float) -> float:
+    """
+    Returns a travel duration read from a travel time matrix as compute_travel_time returns it:
+    an int when it is a whole number of hours, math.inf when the travel is not possible.
+    """
+    if time == math.inf:
+        return math.inf
+    return int(time) if time.is_integer() else time
+
+
 class CrappyCrepeCar(Vehicle):
     """
     A type of vehicle that:
@@ -43,11 +149,56 @@ class CrappyCrepeCar(Vehicle):
         Returns the travel duration of a direct trip from one city
         to another, in hours, rounded up to an integer.
         """
+        return as_hours(self.travel_time_matrix([departure], [arrival])[0, 0])
+
+    def travel_time_matrix(self, origins: list[City], destinations: list[City]) -> np.ndarray:
+        """
+        Returns a matrix of the travel durations of the direct trips from every city of origins (rows)
+        to every city of destinations (columns), in hours, rounded up to an integer.
+        """
+
+        distances = distance_matrix(origins, destinations)  # gets the distance between every 2 cities
+        times = distances / self.speed                      # formulate the time taken for the said distances
+
+        return np.ceil(times)                               # returns the times
+
+    def leg_travel_times(self, departures: list[City], arrivals: list[City]) -> np.ndarray:
+        """
+        Returns an array of the travel durations of the direct trips from every city of departures to the city
+        at the same position in arrivals, in hours, rounded up to an integer.
+        """
+        return np.ceil(pair_distances(departures, arrivals) / self.speed)
+
+    def routing_capability(self) -> RoutingCapability:
+        """
+        Returns RoutingCapability.direct: the car can go anywhere, and as the distances follow the triangle inequality
+        and every leg is rounded up, a direct trip is never slower than going through other cities.
+        """
+        return RoutingCapability.direct
+
+    def lower_bound_travel_time(self, departure: City, arrival: City) -> float:
+        """
+        Returns the great circle distance between two cities divided by the speed.
+        """
+        return departure.distance(arrival) / self.speed
+
+    def lower_bound_travel_times(self, departures: list[City], arrival: City) -> np.ndarray:
+        """
+        Returns an array of the great circle distances from every city of departures to a city divided by the speed.
+        """
+        return distance_matrix(departures, [arrival])[:, 0] / self.speed
 
-        distance = departure.distance(arrival)  # gets the distance between 2 cities
-        time = distance / self.speed            # formulate the time taken for the said distance
+    def max_leg_distance(self, max_leg_time: float = math.inf) -> float:
+        """
+        Returns the distance covered at the speed in max_leg_time hours, as the car can go anywhere.
+        """
+        return max_leg_time * self.speed
 
-        return math.ceil(time)                  # returns the time
+    def max_leg_distances(self, max_leg_times: np.ndarray) -> np.ndarray:
+        """
+        Returns an array of the distances covered at the speed in every time of max_leg_times.
+        """
+        return max_leg_times * self.speed
 
     def __str__(self) -> str:
         """
@@ -81,22 +232,94 @@ class DiplomacyDonutDinghy(Vehicle):
         to another, in hours, rounded up to an integer.
         Returns math.inf if the travel is not possible.
         """
+        return as_hours(self.travel_time_matrix([departure], [arrival])[0, 0])
+
+    def travel_time_matrix(self, origins: list[City], destinations: list[City]) -> np.ndarray:
+        """
+        Returns a matrix of the travel durations of the direct trips from every city of origins (rows)
+        to every city of destinations (columns), in hours, rounded up to an integer.
+        Contains math.inf where the travel is not possible.
+        """
+        origin_rows, destination_rows = rows_of(origins), rows_of(destinations)
+        distances = distance_matrix(origins, destinations)
+
+        # pairs of cities in the same country use the country speed
+        same_country = City.table.country_codes[origin_rows][:, np.newaxis] == City.table.country_codes[destination_rows][np.newaxis, :]
+
+        # pairs of primary capitals (of different countries) use the primary speed
+        both_primary = ((City.table.capital_codes[origin_rows] == PRIMARY_CODE)[:, np.newaxis] &
+                        (City.table.capital_codes[destination_rows] == PRIMARY_CODE)[np.newaxis, :])
+
+        # all other invalid cases are math.inf
+        times = np.full(distances.shape, math.inf)
+        times[both_primary] = np.ceil(distances[both_primary] / self.prim_speed)
+        times[same_country] = np.ceil(distances[same_country] / self.count_speed)
+
+        return times
+
+    def leg_travel_times(self, departures: list[City], arrivals: list[City]) -> np.ndarray:
+        """
+        Returns an array of the travel durations of the direct trips from every city of departures to the city
+        at the same position in arrivals, in hours, rounded up to an integer.
+        Contains math.inf where the travel is not possible.
+        """
+        departure_rows, arrival_rows = rows_of(departures), rows_of(arrivals)
+        distances = pair_distances(departures, arrivals)
+
+        same_country = City.table.country_codes[departure_rows] == City.table.country_codes[arrival_rows]
+        both_primary = (City.table.capital_codes[departure_rows] == PRIMARY_CODE) & (City.table.capital_codes[arrival_rows] == PRIMARY_CODE)
+
+        times = np.full(distances.shape, math.inf)
+        times[both_primary] = np.ceil(distances[both_primary] / self.prim_speed)
+        times[same_country] = np.ceil(distances[same_country] / self.count_speed)
+
+        return times
+
+    def lower_bound_travel_time(self, departure: City, arrival: City) -> float:
+        """
+        Returns the great circle distance between two cities divided by the fastest of the two speeds.
+        """
+        return departure.distance(arrival) / max(self.count_speed, self.prim_speed)
+
+    def lower_bound_travel_times(self, departures: list[City], arrival: City) -> np.ndarray:
+        """
+        Returns an array of the great circle distances from every city of departures to a city divided by the fastest of the two speeds.
+        """
+        return distance_matrix(departures, [arrival])[:, 0] / max(self.count_speed, self.prim_speed)
+
+    def max_leg_distance(self, max_leg_time: float = math.inf) -> float:
+        """
+        Returns the distance covered at the fastest of the two speeds in max_leg_time hours.
+        """
+        return max_leg_time * max(self.count_speed, self.prim_speed)
+
+    def max_leg_distances(self, max_leg_times: np.ndarray) -> np.ndarray:
+        """
+        Returns an array of the distances covered at the fastest of the two speeds in every time of max_leg_times.
+        """
+        return max_leg_times * max(self.count_speed, self.prim_speed)
 
-        # if departure country and arrival country is the same, find the distance and compute the time with country speed
-        if departure.country == arrival.country:
-            distance = departure.distance(arrival)
-            time = distance / self.count_speed
-            return math.ceil(time)
+    def leg_groups(self, cities: list[City]) -> list[list[City]]:
+        """
+        Returns the cities of every country, and the primary capitals.
+        """
+        countries = dict()  # a dict that associates country names to the list of their cities
+        primaries = []      # stores the primary capitals
 
-        # if departure country and arrival country is primary capital type, find the distance and compute the time with country speed
-        elif departure.capital_type == CapitalType.primary and arrival.capital_type == CapitalType.primary:
-            distance = departure.distance(arrival)
-            time = distance / self.prim_speed
-            return math.ceil(time)
+        for city in cities:
+            countries.setdefault(city.country, []).append(city)
+            if city.capital_type == CapitalType.primary:
+                primaries.append(city)
 
-        # all other invalid cases return math.inf
-        else:
-            return math.inf
+        return list(countries.values()) + [primaries]
+
+    def leg_group_is_direct(self, group: list[City]) -> bool:
+        """
+        Returns True for the cities of a single country: they all travel at the country speed, and as the distances
+        follow the triangle inequality and every leg is rounded up, a direct trip is never slower than going through
+        other cities of the country. The primary capitals of several countries mix both speeds, so they are not.
+        """
+        return len(np.unique(City.table.country_codes[rows_of(group)])) <= 1
 
     def __str__(self) -> str:
         """
@@ -125,16 +348,65 @@ class TeleportingTarteTrolley(Vehicle):
         to another, in hours, rounded up to an integer.
         Returns math.inf if the travel is not possible.
         """
-        # gets the distance between departure and arrival cities
-        distance = departure.distance(arrival)
+        return as_hours(self.travel_time_matrix([departure], [arrival])[0, 0])
+
+    def travel_time_matrix(self, origins: list[City], destinations: list[City]) -> np.ndarray:
+        """
+        Returns a matrix of the travel durations of the direct trips from every city of origins (rows)
+        to every city of destinations (columns), in hours: the fixed time if their distance is less than
+        the max distance, math.inf otherwise.
+        """
+        distances = distance_matrix(origins, destinations)
+
+        return np.where(distances < self.distance, float(self.time), math.inf)
+
+    def leg_travel_times(self, departures: list[City], arrivals: list[City]) -> np.ndarray:
+        """
+        Returns an array of the travel durations of the direct trips from every city of departures to the city
+        at the same position in arrivals, in hours: the fixed time if their distance is less than
+        the max distance, math.inf otherwise.
+        """
+        return np.where(pair_distances(departures, arrivals) < self.distance, float(self.time), math.inf)
+
+    def routing_capability(self) -> RoutingCapability:
+        """
+        Returns RoutingCapability.unweighted, as every direct trip takes the fixed time.
+        """
+        return RoutingCapability.unweighted
+
+    def lower_bound_travel_time(self, departure: City, arrival: City) -> float:
+        """
+        Returns the fixed time multiplied by the great circle distance between two cities over the maximum distance,
+        as every direct trip covers less than the maximum distance.
+        """
+        # no direct trip is possible without a maximum distance, so there is nothing to bound
+        if self.distance <= 0:
+            return 0
+
+        return self.time * departure.distance(arrival) / self.distance
+
+    def lower_bound_travel_times(self, departures: list[City], arrival: City) -> np.ndarray:
+        """
+        Returns an array of the fixed time multiplied by the great circle distances from every city of departures
+        to a city over the maximum distance.
+        """
+        if self.distance <= 0:
+            return np.zeros(len(departures))
 
-        # if computes distance is less than max distance, return the fixed time
-        if distance < self.distance:
-            return self.time
+        return self.time * distance_matrix(departures, [arrival])[:, 0] / self.distance
 
-        # all other cases return math.inf
-        else:
-            return math.inf
+    def max_leg_distance(self, max_leg_time: float = math.inf) -> float:
+        """
+        Returns the maximum distance, as direct trips are only possible between cities closer than it,
+        or 0 if max_leg_time is shorter than the fixed time.
+        """
+        return self.distance if max_leg_time >= self.time else 0
+
+    def max_leg_distances(self, max_leg_times: np.ndarray) -> np.ndarray:
+        """
+        Returns an array of the maximum distance for every time of max_leg_times at least the fixed time, and 0 for the others.
+        """
+        return np.where(max_leg_times >= self.time, float(self.distance), 0.0)
 
     def __str__(self) -> str:
         """